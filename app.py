@@ -2,7 +2,7 @@
 # This script consists of 5 parts
 #
 # 1. Loading and setting states
-#   - Import models
+#   - Load models (once per process)
 #   - Set site states 
 #   - Set site configs
 #
@@ -28,40 +28,26 @@
 #   - Await confirmation for modelling
 #
 
-import torch
-import tempfile
+import config
 import streamlit as st
-import tensorflow as tf
-from tensorflow import keras
-from keras.utils import array_to_img
+from utils.image_ingest import read_image
+from utils.raster_reader import is_large, open_raster
 from utils.picture_fetch import *
-from utils.unet_model import UNet
-from utils.map_utils import final_pred
+from utils.model_registry import warm_up, get_classifier, get_mapping_model
+from utils.instrumentation import (
+    count, span, start_metrics_server, write_prometheus)
 from streamlit_folium import st_folium
 
 
 # 1. Loading and setting states
 # ------------------------------
 
-# load keras classification model
-model = keras.models.load_model('utils/class_model.h5')
-
-# import torch mppaing architechture
-mapping_model = UNet(
-    in_channels=3,
-    out_channels=2,
-    n_blocks=4,
-    start_filters=32,
-    activation="relu",
-    normalization="batch",
-    conv_mode="same",
-    dim=2,
-)
-
-# load weights for mapping model
-weights_path = 'utils/mapping_weights.pt'
-model_weights = torch.load(weights_path)
-mapping_model.load_state_dict(model_weights)
+# load keras classification and torch mapping models,
+# once per process rather than on every rerun
+warm_up(background=True)
+
+# expose stage timings if metrics are enabled in config
+start_metrics_server()
 
 # expand sidebar
 st.set_page_config(initial_sidebar_state="expanded")
@@ -150,39 +136,51 @@ if not st.session_state.download:
 # 4. Image processing
 # ------------------------------
 
+raster = None
 if st.session_state.download:
-    # create tempdir for image storage 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # if nothing uploaded, download from map
-        if not picture_path:
-            picture_path = download_picture(
-                bbox=bbox,
-                dir_name=temp_dir + "/")
-        # load image to np array
-        image = tf.keras.preprocessing.image.load_img(picture_path)
-
-        # display image
-        col3, col4 = st.columns([7, 2])
-        with col3:
-            st.image(image.resize((4000, 4000)))
-
-        with col4:
-            st.markdown(
-                """Click **Yes** if you
-                want to analyse 
-                this area."""
-            )
+    # if nothing uploaded, download from map into memory,
+    # at full resolution only if the mapping model needs it
+    if not picture_path:
+        size = config.full_size if config.tiled_mapping else config.display_size
+        picture_path = fetch_picture(bbox, size)
+    # decode, large uploads straight to display size and
+    # very large ones only window by window when analysed
+    with span("decode") as s:
+        if is_large(picture_path):
+            try:
+                raster = open_raster(picture_path)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            image = raster.thumbnail(config.display_size)
+        else:
+            image = read_image(
+                picture_path,
+                None if config.tiled_mapping else config.display_size)
+        s.set(size=image.size)
+
+    # display image
+    col3, col4 = st.columns([7, 2])
+    with col3, span("display_resize"):
+        st.image(image.resize((config.display_size, config.display_size)))
+
+    with col4:
+        st.markdown(
+            """Click **Yes** if you
+            want to analyse 
+            this area."""
+        )
 
-            st.markdown(
-                """Otherwise, place 
-                a new pin on
-                the map or upload
-                another image."""
-            )
+        st.markdown(
+            """Otherwise, place 
+            a new pin on
+            the map or upload
+            another image."""
+        )
 
-            # await confirmation
-            if st.button("Yes"):
-                st.session_state.accepted = True
+        # await confirmation
+        if st.button("Yes"):
+            st.session_state.accepted = True
 
     # throw away image and unset state if user keeps scrolling
     # on map or removes uploaded picture
@@ -192,35 +190,119 @@ if st.session_state.download:
 # 5. Modeling
 # ------------------------------
 
+# very large uploads are scanned window by window
+if st.session_state.accepted and raster is not None:
+    from utils.analysis import Cascade
+    from utils.raster_reader import scan_raster
+
+    with st.spinner("Scanning %dx%d pixels..." % (raster.width, raster.height)):
+        with span("scan_raster", size=(raster.width, raster.height)):
+            cascade = Cascade(get_classifier(), get_mapping_model())
+            silos, area = 0, 0.0
+            for _, _, result in scan_raster(raster, cascade, config.model_size):
+                silos += len(result["silos"])
+                area += result["area"]
+
+    col5, col6 = st.columns([7, 2])
+    with col5:
+        st.image(image)
+    with col6:
+        st.markdown(
+            """
+        Found %d silos in %d of
+        the %d windows, covering
+        %.1f square meters.
+        """
+            % (silos, cascade.segmented, cascade.tiles, area)
+        )
+        if raster.pixel_area is None:
+            st.caption(
+                "No georeferencing found, areas assume every %d pixel "
+                "window covers 128 x 128 meters." % config.model_size
+            )
+
+    write_prometheus()
+    raster.close()
+    st.session_state.accepted = False
+
 if st.session_state.accepted:
-    # resize to fit models
-    image = image.resize((256, 256))
+    from utils.map_utils import predict_mask, summarise
+    from utils.inference_queue import classify, segment
+    from utils.prediction_memo import get_memo
 
-    # convert to np.array
-    input_arr = tf.keras.preprocessing.image.img_to_array(image)
+    # resize to fit models
+    with span("model_resize", size=image.size):
+        model_image = image.resize((config.model_size, config.model_size))
 
-    # spinning waiter while modelling
-    with st.spinner("Wait for it..."):
-        # classification model
-        class_arrary = preprocess_class(input_arr)
-        predictions = model.predict(
-            [np.array([class_arrary])])[0][0]
+    # convert to uint8 np.array, the models scale the pixels themselves
+    input_arr = np.asarray(model_image)
+    if config.tiled_mapping:
+        mapping_arr = np.asarray(image)
+    else:
+        mapping_arr = input_arr
+
+    # reruns and other sessions may have analysed this picture already
+    memo = get_memo()
+    if memo is not None:
+        memo_key = memo.key(
+            picture_path,
+            model_size=config.model_size,
+            display_size=config.display_size,
+            tiled=config.tiled_mapping,
+            threshold=config.cascade_threshold)
+        memoised = memo.get(memo_key)
+    else:
+        memoised = None
 
-        # mapping model
-        covered, area, category = final_pred(
-            img=input_arr / 255,
-            model=mapping_model,
-            device=torch.device("cpu"))
+    if memoised is not None:
+        predictions = memoised["probability"]
+        mask = memoised["mask"]
+        is_silo = mask is not None
+    else:
+        # spinning waiter while modelling
+        with st.spinner("Wait for it..."):
+            # classification model
+            with span("classify", shape=input_arr.shape):
+                if config.batched_inference:
+                    predictions = classify(input_arr).result()
+                else:
+                    class_arrary = preprocess_class(input_arr)
+                    predictions = get_classifier().predict(
+                        np.array([class_arrary]))[0][0]
+
+            # mapping model, only worth running on silos
+            is_silo = predictions > config.cascade_threshold
+            mask = None
+            if is_silo:
+                with span("final_pred", shape=mapping_arr.shape):
+                    if config.batched_inference and not config.tiled_mapping:
+                        mask = segment(mapping_arr).result()
+                    else:
+                        mask = predict_mask(
+                            mapping_arr,
+                            get_mapping_model(),
+                            tiled=config.tiled_mapping)
+            else:
+                count("cascade_pruned")
+
+    if is_silo:
+        covered, area, category = summarise(mapping_arr, mask)
+    if memo is not None and memoised is None:
+        if is_silo:
+            memo.put(memo_key, predictions, mask, area, category)
+        else:
+            memo.put(memo_key, predictions)
 
     col5, col6 = st.columns([7, 2])
 
     # show picture with overlaid map
-    with col5:
-        st.image(array_to_img(covered).resize((4000, 4000)))
+    with col5, span("overlay_resize"):
+        shown = array_to_image(covered) if is_silo else image
+        st.image(shown.resize((config.display_size, config.display_size)))
 
     # show our predictions
     with col6:
-        if predictions > 0.5:
+        if is_silo:
             st.balloons()
             st.markdown("It's a silo ! 🌾")
             st.markdown("With silo probablity %.2f" % predictions)
@@ -238,6 +320,8 @@ if st.session_state.accepted:
             st.markdown("It's not a silo ! 😞")
             st.markdown("With silo probablity %.2f" % predictions)
 
+    write_prometheus()
+
     if st.button("❄️") or st.session_state.snow:
         st.session_state.snow = True
         st.video("https://youtu.be/E8gmARGvPlI")
@@ -1,2 +1,92 @@
-#keras_model = 
-#mapping_weights = 
\ No newline at end of file
+keras_model = "utils/class_model.h5"
+mapping_weights = "utils/mapping_weights.pt"
+
+# architecture of the torch mapping model
+mapping_model = dict(
+    in_channels=3,
+    out_channels=2,
+    n_blocks=4,
+    start_filters=32,
+    activation="relu",
+    normalization="batch",
+    conv_mode="same",
+    dim=2,
+)
+
+# optimised mapping model written by utils/unet_export.py, a TorchScript
+# .pt or an .onnx file, used instead of the eager UNet when set
+mapping_export = None
+
+# classifier converted by utils/convert_models.py, used instead of
+# keras_model when set. With both exports in .onnx, serving
+# needs neither TensorFlow nor torch
+classifier_export = None
+
+# intra-op and inter-op threads of the inference runtimes, 0 lets
+# them decide. channels_last and inference_mode apply to the eager
+# UNet. utils/autotune.py tunes these for the host and saves them to
+# tuning_profile, which overrides the values here when present
+inference_threads = 0
+interop_threads = 0
+channels_last = False
+inference_mode = False
+tuning_profile = "tuning_profile.json"
+
+# app sessions share batched model calls, see utils/inference_queue.py:
+# a batch waits at most batch_max_wait seconds for up to *_batch_size
+# pictures. Larger UNet batches only pay off with several cores
+batched_inference = True
+batch_max_wait = 0.01
+classify_batch_size = 32
+segment_batch_size = 4
+
+# IGN orthophoto WMS endpoint, point it to utils/wms_stub.py to work offline
+wms_url = "https://wxs.ign.fr/ortho/geoportail/r/wms"
+wms_connections = 4
+wms_retries = 3
+wms_timeout = 60
+
+# downloaded pictures are cached here, set to None to disable
+tile_cache_dir = ".tile_cache"
+tile_cache_bytes = 2 * 1024**3
+
+# picture sizes requested from the WMS, in pixels per side:
+# model input, display in the app column, and full resolution
+model_size = 256
+display_size = 700
+full_size = 4000
+
+# segment the full resolution picture window by window
+# instead of the model_size one
+tiled_mapping = False
+
+# finished analyses remembered across reruns and sessions, see
+# utils/prediction_memo.py. 0 disables the memo, memo_dir also keeps
+# them on disk (entries are a few hundred bytes and never evicted)
+memo_entries = 256
+memo_dir = None
+
+# MBTiles silo probability map shown over draw_map, built by
+# utils/tile_pyramid.py and served on tile_server_host:tile_server_port,
+# local only by default. Set tile_server_url when browsers reach the
+# server under another address
+tile_pyramid = None
+tile_server_host = "127.0.0.1"
+tile_server_port = 8502
+tile_server_url = None
+
+# uploads above this many pixels are read and analysed window by
+# window, see utils/raster_reader.py
+raster_max_pixels = 4000 * 4000
+
+# silo probability above which a picture is segmented, the mapping
+# model is skipped on pictures the classifier rejects
+cascade_threshold = 0.5
+
+# per-stage timings and counters, see utils/instrumentation.py
+metrics_enabled = False
+# Prometheus text file and/or port serving /metrics, None to disable.
+# /metrics listens on metrics_host, local only by default
+metrics_file = None
+metrics_port = None
+metrics_host = "127.0.0.1"
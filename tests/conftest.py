@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+
+class ConstantModel:
+    """
+    Stands in for the classifier: the same silo probability for every image.
+    """
+
+    def __init__(self, probability: float):
+        self.probability = probability
+
+    def predict(self, batch):
+        return np.full((len(batch), 1), self.probability, dtype=np.float32)
+
+
+@pytest.fixture
+def constant_model():
+    return ConstantModel
@@ -0,0 +1,24 @@
+import numpy as np
+from utils.analysis import Cascade, segment_batch
+from utils.map_utils import _predict_batch
+
+
+class Unused:
+    def predict(self, batch):
+        raise AssertionError("the mapping model should not run")
+
+
+def test_empty_batch():
+    assert len(_predict_batch([], Unused())) == 0
+    assert segment_batch([], Unused()) == []
+
+
+def test_cascade_all_negative(constant_model):
+    imgs = [np.zeros((64, 64, 3), dtype=np.uint8) for _ in range(3)]
+    cascade = Cascade(constant_model(0.1), Unused(), threshold=0.5)
+
+    results = cascade.run(imgs)
+
+    assert len(results) == 3
+    assert all(r["mask"] is None and r["area"] == 0.0 and r["silos"] == [] for r in results)
+    assert cascade.stats() == {"tiles": 3, "segmented": 0, "pruned": 3}
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from utils import inference_engine
+from utils.inference_engine import Engine, TorchEngine
+from utils.convert_models import classifier_parity
+from utils.model_eval import model_bytes
+from utils.unet_model import UNet
+
+
+class Constant(Engine):
+    def __init__(self, value):
+        self.value = value
+
+    def predict(self, batch):
+        return np.full((len(batch), 1), self.value, dtype=np.float32)
+
+
+def test_engine_is_abstract():
+    with pytest.raises(TypeError):
+        Engine()
+
+
+def test_model_bytes_of_torch_engine():
+    engine = TorchEngine(UNet(in_channels=3, n_blocks=2, start_filters=4))
+    assert engine.path is None
+    assert model_bytes(engine) > 0
+
+
+def test_classifier_parity(monkeypatch):
+    engines = {"reference": 0.5, "close": 0.50001, "far": 0.6}
+    monkeypatch.setattr("config.keras_model", "reference")
+    monkeypatch.setattr(inference_engine, "load_engine", lambda path: Constant(engines[path]))
+    batch = np.zeros((2, 8, 8, 3), dtype=np.float32)
+
+    assert classifier_parity("close", batch, atol=1e-4) == pytest.approx(1e-5, abs=1e-6)
+    with pytest.raises(ValueError):
+        classifier_parity("far", batch, atol=1e-4)
@@ -0,0 +1,81 @@
+import time
+import threading
+import pytest
+from utils.inference_queue import MicroBatcher
+
+
+class Recorder:
+    """
+    Fake model function: doubles its items and records the batches.
+    """
+
+    def __init__(self, gate: threading.Event = None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, items):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(items))
+        return [2 * item for item in items]
+
+
+def test_single_request_waits_at_most_max_wait():
+    fn = Recorder()
+    batcher = MicroBatcher(fn, max_size=8, max_wait=0.05)
+    start = time.monotonic()
+    assert batcher.submit(3).result(timeout=5) == 6
+    assert 0.04 <= time.monotonic() - start < 1
+    batcher.close()
+    assert fn.batches == [[3]]
+
+
+def test_gathers_until_the_deadline():
+    fn = Recorder()
+    batcher = MicroBatcher(fn, max_size=8, max_wait=0.5)
+    futures = [batcher.submit(i) for i in range(3)]
+    assert [f.result(timeout=5) for f in futures] == [0, 2, 4]
+    batcher.close()
+    assert fn.batches == [[0, 1, 2]]
+
+
+def test_max_size_cuts_batches():
+    fn = Recorder()
+    batcher = MicroBatcher(fn, max_size=4, max_wait=1.0)
+    start = time.monotonic()
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(timeout=5) for f in futures] == [2 * i for i in range(10)]
+    batcher.close()
+    assert [len(batch) for batch in fn.batches[:2]] == [4, 4]
+    assert all(len(batch) <= 4 for batch in fn.batches)
+    # full batches do not wait for the deadline
+    assert time.monotonic() - start < 1.5
+
+
+def test_exception_reaches_every_future():
+    def fail(items):
+        raise RuntimeError("model failed")
+
+    batcher = MicroBatcher(fail, max_size=4, max_wait=0.2)
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(timeout=5)
+    batcher.close()
+
+
+def test_cancelled_requests_are_dropped():
+    gate = threading.Event()
+    fn = Recorder(gate)
+    batcher = MicroBatcher(fn, max_size=1, max_wait=0.0)
+    busy = batcher.submit("busy")  # holds the worker until the gate opens
+    time.sleep(0.1)
+    cancelled = batcher.submit("cancelled")
+    kept = batcher.submit("kept")
+    assert cancelled.cancel()
+    gate.set()
+
+    assert busy.result(timeout=5) == "busybusy"
+    assert kept.result(timeout=5) == "keptkept"
+    batcher.close()
+    assert ["cancelled"] not in fn.batches
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from utils.map_utils import _calcul_area, _predict_tiled, extract_silos
+
+
+def test_tiled_overlap_is_validated():
+    img = np.zeros((300, 300, 3), dtype=np.uint8)
+    for overlap in (-1, 256, 300):
+        with pytest.raises(ValueError):
+            _predict_tiled(img, model=None, tile_size=256, overlap=overlap)
+
+
+def test_area_of_non_square_picture():
+    # a 128 x 128 m picture, 256 px high and 512 px wide
+    mask = np.zeros((256, 512), dtype=np.uint8)
+    mask[:10, :20] = 1
+    pixel_area = (128 / 256) * (128 / 512)
+
+    assert _calcul_area(mask) == 200 * pixel_area
+    assert _calcul_area(np.ones((256, 256))) == 128 * 128
+    (silo,) = extract_silos(mask)
+    assert silo["area"] == 200 * pixel_area
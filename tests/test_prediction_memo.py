@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+from utils.prediction_memo import PredictionMemo, pack_mask, unpack_mask
+
+
+@pytest.fixture
+def model_files(tmp_path, monkeypatch):
+    paths = []
+    for name in ("classifier.onnx", "mapping.pt"):
+        path = tmp_path / name
+        path.write_bytes(b"weights")
+        paths.append(str(path))
+    monkeypatch.setattr("config.classifier_export", paths[0])
+    monkeypatch.setattr("config.mapping_export", paths[1])
+    return paths
+
+
+def test_pack_round_trip():
+    mask = np.random.default_rng(0).integers(0, 2, (13, 21)).astype(np.uint8)
+    assert mask.size % 8
+    np.testing.assert_array_equal(unpack_mask(pack_mask(mask), mask.shape), mask)
+
+
+def test_lru_eviction():
+    memo = PredictionMemo(max_entries=2)
+    memo.put("a", 0.1)
+    memo.put("b", 0.2)
+    assert memo.get("a")["probability"] == pytest.approx(0.1)  # b is now the oldest
+    memo.put("c", 0.3)
+
+    assert memo.get("b") is None
+    assert memo.get("a") is not None and memo.get("c") is not None
+
+
+def test_disk_round_trip(tmp_path):
+    mask = np.zeros((10, 12), dtype=np.uint8)
+    mask[2:5, 3:9] = 1
+    PredictionMemo(directory=str(tmp_path)).put(
+        "k", 0.9, mask=mask, area=4.5, category="small"
+    )
+
+    entry = PredictionMemo(directory=str(tmp_path)).get("k")  # a fresh process
+    assert entry["probability"] == pytest.approx(0.9)
+    assert entry["area"] == 4.5 and entry["category"] == "small"
+    np.testing.assert_array_equal(entry["mask"], mask)
+
+    PredictionMemo(directory=str(tmp_path)).put("rejected", 0.1)
+    assert PredictionMemo(directory=str(tmp_path)).get("rejected")["mask"] is None
+
+
+def test_key_changes_with_model_files(model_files):
+    picture = b"jpeg bytes"
+    key = PredictionMemo.key(picture, tiled=False)
+    assert PredictionMemo.key(picture, tiled=False) == key
+    assert PredictionMemo.key(picture, tiled=True) != key
+
+    stat = os.stat(model_files[1])
+    os.utime(model_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert PredictionMemo.key(picture, tiled=False) != key
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from utils.analysis import Cascade
+from utils.raster_reader import Raster, scan_raster, _bands, _to_rgb, _to_uint8
+
+
+class ArrayRaster(Raster):
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.height, self.width = pixels.shape[:2]
+
+    def read(self, x, y, width, height):
+        out = np.zeros((height, width, 3), dtype=np.uint8)
+        window = self.pixels[y : y + height, x : x + width]
+        out[: window.shape[0], : window.shape[1]] = window
+        return out
+
+
+class Threshold:
+    # two class logits, silo where the red channel is lit
+    def predict(self, batch):
+        return np.stack([0.5 - batch[:, 0], batch[:, 0] - 0.5], axis=1)
+
+
+def test_overlapping_windows_count_once(constant_model):
+    # the last window of each axis starts at 344 and overlaps the one at 256
+    pixels = np.zeros((600, 600, 3), dtype=np.uint8)
+    pixels[300:320, 400:420, 0] = 255
+    pixels[10:20, 10:20, 0] = 255
+    cascade = Cascade(constant_model(1.0), Threshold())
+
+    results = [r for *_, r in scan_raster(ArrayRaster(pixels), cascade, size=256)]
+
+    assert sum(len(r["silos"]) for r in results) == 2
+    assert sum(r["area"] for r in results) == (400 + 100) * (128 / 256) ** 2
+
+
+def test_pixel_area(constant_model):
+    pixels = np.zeros((300, 300, 3), dtype=np.uint8)
+    pixels[:10, :10, 0] = 255
+    raster = ArrayRaster(pixels)
+    raster.pixel_area = 0.25
+    cascade = Cascade(constant_model(1.0), Threshold())
+
+    results = [r for *_, r in scan_raster(raster, cascade, size=256)]
+
+    assert sum(r["area"] for r in results) == 100 * 0.25
+
+
+def test_bands():
+    assert _bands(1) == [1]
+    assert _bands(2) == [1]  # grey and alpha
+    assert _bands(3) == [1, 2, 3]
+    assert _bands(4) == [1, 2, 3]
+    grey_alpha = np.zeros((4, 4, 2), dtype=np.uint8)
+    assert _to_rgb(grey_alpha).shape == (4, 4, 3)
+
+
+def test_to_uint8():
+    assert _to_uint8(np.array([0, 65535, 32768], dtype=np.uint16)).tolist() == [0, 255, 128]
+    assert _to_uint8(np.array([-5, 32767], dtype=np.int16)).tolist() == [0, 255]
+    assert _to_uint8(np.array([0.0, 0.5, 2.0], dtype=np.float32)).tolist() == [0, 128, 255]
+    pixels = np.array([3, 200], dtype=np.uint8)
+    assert _to_uint8(pixels) is pixels
+
+
+def test_raster_is_abstract():
+    with pytest.raises(TypeError):
+        Raster()
@@ -0,0 +1,54 @@
+import csv
+import itertools
+import numpy as np
+import pytest
+from utils.map_layer import DATA_PATH
+from utils.region_index import RegionIndex, aggregate, load_index
+from utils.region_scan import load_region, region_tiles
+
+
+@pytest.fixture(scope="module")
+def index():
+    return load_index()
+
+
+def test_locate_matches_brute_force(index):
+    # one band holding every edge: a plain cast over all of them
+    whole = RegionIndex(band_height=1000)
+    assert whole.n_bands == 1
+
+    lons, lats = index._edges[:, [0, 2]], index._edges[:, [1, 3]]
+    rng = np.random.default_rng(0)
+    points_lon = rng.uniform(lons.min() - 0.5, lons.max() + 0.5, 3000)
+    points_lat = rng.uniform(lats.min() - 0.5, lats.max() + 0.5, 3000)
+
+    expected = whole._cast(points_lon, points_lat, whole._edges, whole._owners)
+    located = index.locate(points_lon, points_lat, chunk=10_000)
+
+    np.testing.assert_array_equal(located, expected)
+    assert (located >= 0).any() and (located == -1).any()
+
+
+def test_locate_region_tiles(index):
+    tiles = list(itertools.islice(region_tiles(load_region("Bretagne")), 0, 2000, 100))
+    lons, lats = np.array(tiles).T
+    assert (index.locate(lons, lats) == index.names.index("Bretagne")).all()
+
+
+def test_aggregate(index):
+    tiles = list(itertools.islice(region_tiles(load_region("Bretagne")), 3))
+    lons, lats = np.array(tiles + [(-40.0, 10.0)]).T  # the last one is at sea
+    areas = [10.0, 100.0, 500.0, 1.0]
+    categories = ["small", "medium", "huge", "small"]
+
+    rows = {row["region"]: row for row in aggregate(lons, lats, areas, categories, index)}
+
+    with open(DATA_PATH, encoding="utf-8") as f:
+        data = {row["Regions"]: row for row in csv.DictReader(f)}
+    bretagne = rows["Bretagne"]
+    assert bretagne["silos"] == 3
+    assert bretagne["area"] == 610.0
+    assert [bretagne[c] for c in ("small", "medium", "big", "huge")] == [1, 1, 0, 1]
+    assert bretagne["famine"] == float(data["Bretagne"]["Famine %"])
+    assert bretagne["food_production"] == float(data["Bretagne"]["Food Production"])
+    assert sum(row["silos"] for row in rows.values()) == 3
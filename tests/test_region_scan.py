@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from utils import region_scan
+
+
+class Everything:
+    # every pixel is a silo
+    def predict(self, batch):
+        logits = np.zeros((len(batch), 2) + batch.shape[2:], dtype=np.float32)
+        logits[:, 1] = 1
+        return logits
+
+
+def test_detection_writer_failure(monkeypatch, tmp_path, constant_model):
+    def fetch_tiles(tiles, workers, maxsize):
+        for lon, lat in tiles:
+            yield lon, lat, "%f,%f,%f,%f" % (lat, lon, lat + 1, lon + 1), np.zeros(
+                (32, 32, 3), dtype=np.uint8
+            )
+
+    monkeypatch.setattr(region_scan, "fetch_tiles", fetch_tiles)
+    # the detections go to a folder that does not exist
+    with pytest.raises(FileNotFoundError):
+        region_scan.scan_region(
+            "Bretagne",
+            str(tmp_path / "silos.csv"),
+            constant_model(1.0),
+            Everything(),
+            batch_size=1,
+            limit=50,
+            detections_path=str(tmp_path / "missing" / "found.csv"),
+        )
@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from utils import tile_cache
+from utils.tile_cache import TileCache
+
+
+def _age(cache, key, mtime):
+    os.utime(cache._path(key), (mtime, mtime))
+
+
+def test_key_normalises_bbox():
+    assert TileCache.key("48.1,2.3,48.2,2.4", WIDTH=256) == TileCache.key(
+        "48.10,2.30,48.20,2.40", WIDTH=256
+    )
+    assert TileCache.key("48.1,2.3,48.2,2.4", WIDTH=256) != TileCache.key(
+        "48.1,2.3,48.2,2.4", WIDTH=512
+    )
+
+
+def test_hits_and_misses(tmp_path):
+    cache = TileCache(str(tmp_path))
+    assert cache.get("a") is None
+    cache.put("a", b"jpeg")
+    assert cache.get("a") == b"jpeg"
+    assert cache.get("a") == b"jpeg"
+    assert cache.stats() == {"hits": 2, "misses": 1}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=300)
+    for i, key in enumerate("abc"):
+        cache.put(key, bytes(100))
+        _age(cache, key, 1000 + i)
+    assert cache.get("a") is not None  # a becomes the most recently used
+
+    cache.put("d", bytes(100))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+
+
+def test_byte_cap(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=1000)
+    for i in range(20):
+        cache.put(str(i), bytes(150))
+        _age(cache, str(i), 1000 + i)
+    sizes = [e.stat().st_size for e in os.scandir(tmp_path) if e.name.endswith(".jpg")]
+    assert sum(sizes) <= 1000
+    assert len(sizes) == 6
+    assert cache.get("19") is not None
+
+
+def test_hit_when_evicted_after_read(tmp_path, monkeypatch):
+    cache = TileCache(str(tmp_path))
+    cache.put("a", b"jpeg")
+
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(tile_cache.os, "utime", evicted)
+    assert cache.get("a") == b"jpeg"
+    assert cache.stats() == {"hits": 1, "misses": 0}
+
+
+def test_removes_stale_temporary_files(tmp_path):
+    cache = TileCache(str(tmp_path))
+    stale, fresh = tmp_path / "crashed.tmp", tmp_path / "writing.tmp"
+    stale.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    old = time.time() - tile_cache.STALE_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    cache.put("a", b"jpeg")
+
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_concurrent_sessions(tmp_path):
+    # two caches on one directory, like two Streamlit processes
+    caches = [TileCache(str(tmp_path), max_bytes=2000) for _ in range(2)]
+    errors = []
+
+    def session(cache, offset):
+        try:
+            for i in range(50):
+                key = str((offset + i) % 30)
+                if cache.get(key) is None:
+                    cache.put(key, bytes(100))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=session, args=(caches[i % 2], i * 7)) for i in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    sizes = [e.stat().st_size for e in os.scandir(tmp_path) if e.name.endswith(".jpg")]
+    assert sum(sizes) <= 2000
+    stats = [cache.stats() for cache in caches]
+    assert sum(s["hits"] + s["misses"] for s in stats) == 300
@@ -0,0 +1,36 @@
+import socket
+import urllib.request
+import numpy as np
+from utils import tile_pyramid
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_build_and_serve_locally(tmp_path, monkeypatch):
+    lons, lats = np.meshgrid(np.arange(5) * 0.0016 + 2.3, np.arange(5) * 0.0016 + 48.8)
+    cells = {
+        "lon": lons.ravel(),
+        "lat": lats.ravel(),
+        "probability": np.linspace(0, 1, 25),
+        "area": np.zeros(25),
+        "silos": np.zeros(25, dtype=np.int64),
+        "category": ["small"] * 25,
+    }
+    path = str(tmp_path / "silos.mbtiles")
+    assert tile_pyramid.build(cells, path, min_zoom=10, max_zoom=12) > 0
+
+    monkeypatch.setattr(tile_pyramid, "_server", None)
+    server = tile_pyramid.start_tile_server(path, _free_port())
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        x = int(tile_pyramid._tile_x(2.3, 12))
+        y = int(tile_pyramid._tile_y(48.8, 12))
+        with urllib.request.urlopen("http://127.0.0.1:%d/12/%d/%d.png" % (port, x, y)) as r:
+            assert r.headers["Content-Type"] == "image/png"
+    finally:
+        server.shutdown()
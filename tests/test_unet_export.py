@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from utils.map_utils import _forward
+from utils.unet_model import UNet
+from utils.unet_export import fold_batchnorm, export, load_exported
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    model = UNet(in_channels=3, out_channels=2, n_blocks=3, start_filters=4)
+    # non trivial running statistics and affine parameters
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+@pytest.fixture(scope="module")
+def batch():
+    return np.random.default_rng(0).random((2, 3, 64, 64), dtype=np.float32)
+
+
+def test_fold_batchnorm(model, batch):
+    folded = fold_batchnorm(model)
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in folded.modules())
+    np.testing.assert_allclose(_forward(batch, folded), _forward(batch, model), atol=1e-5)
+
+
+@pytest.mark.parametrize("extension", [".pt", ".onnx"])
+def test_export(model, batch, tmp_path, extension):
+    if extension == ".onnx":
+        pytest.importorskip("onnxruntime")
+    path = str(tmp_path / ("unet" + extension))
+    export(model, path, size=32)
+    exported = load_exported(path)
+
+    # traced at 32 px, run at 64 px
+    np.testing.assert_allclose(exported.predict(batch), _forward(batch, model), atol=1e-4)
+
+
+def test_export_size(model, tmp_path):
+    with pytest.raises(ValueError):
+        export(model, str(tmp_path / "unet.pt"), size=30)
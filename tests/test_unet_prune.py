@@ -0,0 +1,60 @@
+import json
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from utils.map_utils import _forward
+from utils.unet_model import UNet
+from utils.unet_prune import prune, save, unet_config
+
+
+def _model(normalization, up_mode):
+    torch.manual_seed(0)
+    model = UNet(
+        in_channels=3,
+        out_channels=2,
+        n_blocks=3,
+        start_filters=8,
+        normalization=normalization,
+        up_mode=up_mode,
+    )
+    # non trivial running statistics and affine parameters
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+@pytest.fixture(scope="module")
+def batch():
+    return np.random.default_rng(0).random((2, 3, 32, 32), dtype=np.float32)
+
+
+@pytest.mark.parametrize("normalization", ["batch", None])
+@pytest.mark.parametrize("up_mode", ["transposed", "bilinear"])
+@pytest.mark.parametrize("method", ["bn", "magnitude"])
+def test_same_width_is_exact(batch, normalization, up_mode, method):
+    model = _model(normalization, up_mode)
+    pruned = prune(model, model.start_filters, method)
+    np.testing.assert_array_equal(_forward(batch, pruned), _forward(batch, model))
+
+
+@pytest.mark.parametrize("up_mode", ["transposed", "bilinear"])
+def test_slim_model_loads_through_the_constructor(batch, tmp_path, up_mode):
+    model = _model("batch", up_mode)
+    slim = prune(model, 4)
+    assert sum(p.numel() for p in slim.parameters()) < sum(
+        p.numel() for p in model.parameters()
+    )
+
+    path = str(tmp_path / "slim.pt")
+    with open(save(slim, path)) as f:
+        kwargs = json.load(f)
+    assert kwargs == dict(unet_config(model), start_filters=4)
+
+    loaded = UNet(**kwargs).eval()
+    loaded.load_state_dict(torch.load(path))
+    np.testing.assert_array_equal(_forward(batch, loaded), _forward(batch, slim))
@@ -0,0 +1,78 @@
+import threading
+import pytest
+from utils.wms_fetch import WMSFetcher, WMSError
+from utils.wms_stub import start_stub_server, render_picture
+
+BBOX = "48.8492,2.3492,48.8508,2.3508"
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_server(**kwargs)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_fetch(stub):
+    _, url = stub()
+    fetcher = WMSFetcher(url)
+    assert fetcher.fetch(BBOX, 64, 64) == render_picture(BBOX, 64, 64)
+    fetcher.close()
+
+
+def test_retry_on_503(stub):
+    server, url = stub(fail_rate=1.0)
+    fetcher = WMSFetcher(url, retries=2, backoff=0.001)
+    with pytest.raises(WMSError, match="HTTP 503"):
+        fetcher.fetch(BBOX, 64, 64)
+    assert len(server.requests) == 3
+    fetcher.close()
+
+
+def test_no_retry_on_4xx(stub):
+    server, url = stub()
+    fetcher = WMSFetcher(url.replace("/wms", "/missing"), retries=2, backoff=0.001)
+    with pytest.raises(WMSError, match="HTTP 404"):
+        fetcher.fetch(BBOX, 64, 64)
+    assert len(server.requests) == 1
+    fetcher.close()
+
+
+def test_xml_exception_with_200(stub):
+    _, url = stub()
+    fetcher = WMSFetcher(url, retries=0)
+    with pytest.raises(WMSError, match="ServiceExceptionReport"):
+        fetcher.fetch(BBOX, "not a width", 64)
+    fetcher.close()
+
+
+def test_fetch_many_keeps_input_order(stub):
+    _, url = stub(latency=0.01)
+    bboxes = [
+        "48.8492,%.6f,48.8508,%.6f" % (2.3492 + i * 0.0016, 2.3508 + i * 0.0016)
+        for i in range(12)
+    ]
+    fetcher = WMSFetcher(url, max_connections=3)
+    results = list(fetcher.fetch_many(bboxes, 32, 32))
+    assert [bbox for bbox, _ in results] == bboxes
+    assert [data for _, data in results] == [render_picture(b, 32, 32) for b in bboxes]
+    fetcher.close()
+
+
+def test_connections_outlive_threads(stub):
+    # e.g. one Streamlit script thread per rerun
+    _, url = stub()
+    fetcher = WMSFetcher(url, max_connections=2)
+    for _ in range(20):
+        thread = threading.Thread(target=fetcher.fetch, args=(BBOX, 16, 16))
+        thread.start()
+        thread.join()
+    assert len(fetcher._connections) == 1
+    fetcher.close()
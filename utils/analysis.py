@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+import config
+from utils.instrumentation import count
+from utils.picture_fetch import preprocess_class
+from utils.map_utils import _predict_batch, _calcul_area, _group, extract_silos
+
+
+def classify_batch(imgs, model, batch_size: int = 32):
+    """
+    Silo probability for a list of equally sized [H, W, C] images
+    with pixel values in [0, 255], in one [B, H, W, C] array.
+    """
+    batch = preprocess_class(np.stack(imgs))  # float32 once, in preprocess_class
+    probabilities = [
+        model.predict(batch[i : i + batch_size])
+        for i in range(0, len(batch), batch_size)
+    ]
+    return np.concatenate(probabilities)[:, 0]
+
+
+def segment_batch(imgs, model, device=None, batch_size: int = 16):
+    """
+    Silo masks for a list of equally sized [H, W, C] images,
+    with the area and size category of each mask and its silos
+    (see extract_silos).
+    """
+    masks = _predict_batch(imgs, model, device, batch_size)
+
+    results = []
+    for mask in masks:
+        area = _calcul_area(mask)
+        results.append(
+            {
+                "mask": mask,
+                "area": area,
+                "category": _group(area),
+                "silos": extract_silos(mask),
+            }
+        )
+    return results
+
+
+def analyse_batch(
+    imgs,
+    class_model,
+    mapping_model,
+    device=None,
+    batch_size: int = 16,
+):
+    """
+    Runs the classification and the mapping model over a list of
+    images and returns one dict per image with keys
+    probability, mask, area, category and silos.
+    """
+    if len(imgs) == 0:
+        return []
+
+    probabilities = classify_batch(imgs, class_model, batch_size)
+    results = segment_batch(imgs, mapping_model, device, batch_size)
+
+    for result, probability in zip(results, probabilities):
+        result["probability"] = float(probability)
+    return results
+
+
+class Cascade:
+    """
+    Classifier first scheduling: every batch goes through the cheap
+    classifier, and only the images whose silo probability is above
+    threshold (config.cascade_threshold by default) are segmented.
+    Rejected images get no mask, no silos and an area of 0.
+
+        cascade = Cascade(get_classifier(), get_mapping_model())
+        results = cascade.run(imgs)
+        cascade.stats()  # {"tiles": 16, "segmented": 3, "pruned": 13}
+    """
+
+    def __init__(
+        self,
+        class_model,
+        mapping_model,
+        threshold: float = None,
+        device=None,
+        batch_size: int = 16,
+    ):
+        self.class_model = class_model
+        self.mapping_model = mapping_model
+        self.threshold = config.cascade_threshold if threshold is None else threshold
+        self.device = device
+        self.batch_size = batch_size
+        self.tiles = 0
+        self.segmented = 0
+        self._lock = threading.Lock()
+
+    def run(self, imgs):
+        """
+        Same results as analyse_batch, in the same order.
+        """
+        if len(imgs) == 0:
+            return []
+
+        probabilities = classify_batch(imgs, self.class_model, self.batch_size)
+        keep = np.flatnonzero(probabilities > self.threshold)
+        segments = []
+        if len(keep):
+            segments = segment_batch(
+                [imgs[i] for i in keep], self.mapping_model, self.device, self.batch_size
+            )
+
+        results = [
+            {"mask": None, "area": 0.0, "category": _group(0), "silos": []}
+            for _ in imgs
+        ]
+        for i, segment in zip(keep, segments):
+            results[i] = segment
+        for result, probability in zip(results, probabilities):
+            result["probability"] = float(probability)
+
+        with self._lock:
+            self.tiles += len(imgs)
+            self.segmented += len(keep)
+        count("cascade_tiles", len(imgs))
+        count("cascade_pruned", len(imgs) - len(keep))
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tiles": self.tiles,
+                "segmented": self.segmented,
+                "pruned": self.tiles - self.segmented,
+            }
@@ -0,0 +1,312 @@
+"""
+CPU inference autotuner.
+
+Machines we deploy on have different core counts, and torch and
+TensorFlow each size their own thread pools when left alone. This tool
+measures the mapping model (final_pred) and the classifier on the
+current host and saves the fastest settings to config.tuning_profile,
+which model_registry applies at startup, so the app and the headless
+tools pick them up without editing config.py.
+
+The search is staged, every stage keeping the best of the previous:
+
+    threads     intra-op x inter-op threads, for one classification
+                followed by one final_pred, as the app does
+    eager       channels-last memory format x torch.inference_mode
+    batch       throughput of *_batch_size for the batch tools and queues
+    backend     eager / keras against the exports given on the command line
+
+Thread pools can only be sized once per process, so every trial runs
+in a fresh subprocess. Like the benchmark suite, the mapping model
+falls back to random weights when config.mapping_weights is missing,
+and the classifier is left out when its model file is missing.
+
+    python -m utils.autotune tune
+    python -m utils.autotune tune --mapping-export unet.onnx --classifier-export classifier.onnx
+    python -m utils.autotune show
+"""
+
+import os
+import sys
+import json
+import platform
+import argparse
+import warnings
+import subprocess
+import numpy as np
+import config
+
+# config settings a profile may override
+TUNED = [
+    "inference_threads",
+    "interop_threads",
+    "channels_last",
+    "inference_mode",
+    "segment_batch_size",
+    "classify_batch_size",
+    "mapping_export",
+    "classifier_export",
+]
+SEGMENT_BATCH_SIZES = (1, 2, 4, 8)
+CLASSIFY_BATCH_SIZES = (1, 8, 32)
+
+# a larger batch must be this much faster to be worth its latency
+MIN_GAIN = 0.05
+
+_applied = False
+
+
+def _host():
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def apply_profile(path: str = None):
+    """
+    Overrides the config settings in TUNED with the tuning profile at
+    path (config.tuning_profile), once per process. Profiles tuned on a
+    host with another number of CPUs are ignored with a warning.
+    """
+    global _applied
+    path = path or config.tuning_profile
+    if _applied or not path or not os.path.exists(path):
+        return None
+    _applied = True
+
+    with open(path) as f:
+        profile = json.load(f)
+    if profile["host"]["cpus"] != os.cpu_count():
+        warnings.warn(
+            "ignoring %s, tuned for %d CPUs on a host with %d"
+            % (path, profile["host"]["cpus"], os.cpu_count())
+        )
+        return None
+    for key, value in profile["settings"].items():
+        if key in TUNED:
+            setattr(config, key, value)
+    return profile
+
+
+def _has_classifier():
+    return bool(config.classifier_export) or os.path.exists(config.keras_model)
+
+
+def _mapping_model():
+    from utils.model_registry import get_mapping_model, _tune_eager
+
+    if config.mapping_export or os.path.exists(config.mapping_weights):
+        return get_mapping_model()
+    from utils.unet_model import UNet
+
+    return _tune_eager(UNet(**config.mapping_model))
+
+
+def trial(spec: dict):
+    """
+    Runs one measurement in this process, which must not have loaded a
+    model yet. spec holds the settings to try, the task ("analysis",
+    "segment" or "classify") and for the latter two the batch size.
+    Returns the p50 latency of one call and the images per second.
+    """
+    from utils.benchmark import time_call
+
+    config.tuning_profile = None  # measure spec, not a previous profile
+    for key, value in spec["settings"].items():
+        setattr(config, key, value)
+
+    rng = np.random.default_rng(0)
+    tile = rng.integers(0, 256, (config.model_size, config.model_size, 3), dtype=np.uint8)
+    batch = spec.get("batch", 1)
+    tiles = [tile] * batch
+    task = spec["task"]
+
+    if task == "analysis":
+        from utils.analysis import classify_batch
+        from utils.map_utils import final_pred
+        from utils.model_registry import get_classifier
+
+        mapping = _mapping_model()
+        classifier = get_classifier() if _has_classifier() else None
+
+        def fn():
+            if classifier is not None:
+                classify_batch(tiles, classifier, batch_size=1)
+            final_pred(tile, mapping)
+
+    elif task == "segment":
+        from utils.map_utils import _predict_batch
+
+        mapping = _mapping_model()
+
+        def fn():
+            _predict_batch(tiles, mapping, batch_size=batch)
+
+    else:
+        from utils.analysis import classify_batch
+        from utils.model_registry import get_classifier
+
+        classifier = get_classifier()
+
+        def fn():
+            classify_batch(tiles, classifier, batch_size=batch)
+
+    stats = time_call(fn, spec.get("repeat", 10), warmup=2)
+    return {
+        "p50_ms": stats["p50_ms"],
+        "p95_ms": stats["p95_ms"],
+        "images_per_s": batch / (stats["p50_ms"] / 1000),
+    }
+
+
+def _run_trial(spec: dict):
+    # a fresh interpreter, so the thread pools are sized from spec
+    process = subprocess.run(
+        [sys.executable, "-m", "utils.autotune", "trial", json.dumps(spec)],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        return {"error": process.stderr.strip().splitlines()[-1:]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+class Tuner:
+    def __init__(self, repeat: int = 10, mapping_exports=(), classifier_exports=()):
+        self.repeat = repeat
+        self.mapping_exports = list(mapping_exports)
+        self.classifier_exports = list(classifier_exports)
+        self.settings = {key: getattr(config, key) for key in TUNED}
+        self.trials = []
+
+    def measure(self, task: str, batch: int = 1, **settings):
+        spec = {
+            "task": task,
+            "batch": batch,
+            "repeat": self.repeat,
+            "settings": dict(self.settings, **settings),
+        }
+        result = _run_trial(spec)
+        self.trials.append(dict(spec, result=result))
+        changes = " ".join("%s=%s" % item for item in sorted(settings.items()))
+        if "error" in result:
+            print("%-9s B=%-3d %-50s failed: %s" % (task, batch, changes, result["error"]))
+        else:
+            print(
+                "%-9s B=%-3d %-50s p50 %8.2f ms  %7.1f images/s"
+                % (task, batch, changes, result["p50_ms"], result["images_per_s"])
+            )
+        return result
+
+    def fastest(self, task: str, candidates, batch: int = 1):
+        """
+        Measures every candidate settings dict, keeps the lowest p50.
+        """
+        results = [(self.measure(task, batch, **c), c) for c in candidates]
+        results = [(r, c) for r, c in results if "error" not in r]
+        if results:
+            _, best = min(results, key=lambda rc: rc[0]["p50_ms"])
+            self.settings.update(best)
+
+    def best_batch(self, task: str, sizes, setting: str):
+        rates = {}
+        for size in sizes:
+            result = self.measure(task, size)
+            if "error" not in result:
+                rates[size] = result["images_per_s"]
+        if not rates:
+            return
+        # the smallest batch within MIN_GAIN of the best throughput
+        best = max(rates.values())
+        self.settings[setting] = min(s for s, r in rates.items() if r >= best * (1 - MIN_GAIN))
+
+    def run(self):
+        cpus = os.cpu_count() or 1
+        threads = sorted({0, cpus} | {2**i for i in range(cpus.bit_length()) if 2**i <= cpus})
+        self.fastest(
+            "analysis",
+            [
+                {"inference_threads": n, "interop_threads": interop}
+                for n in threads
+                for interop in (0, 1)
+            ],
+        )
+
+        if not self.settings["mapping_export"]:
+            self.fastest(
+                "analysis",
+                [
+                    {"channels_last": layout, "inference_mode": mode}
+                    for layout in (False, True)
+                    for mode in (False, True)
+                ],
+            )
+
+        self.best_batch("segment", SEGMENT_BATCH_SIZES, "segment_batch_size")
+        if _has_classifier():
+            self.best_batch("classify", CLASSIFY_BATCH_SIZES, "classify_batch_size")
+
+        mapping = [None] + self.mapping_exports
+        if len(set(mapping)) > 1:
+            self.fastest("analysis", [{"mapping_export": path} for path in mapping])
+        classifier = [None] + self.classifier_exports
+        if len(set(classifier)) > 1:
+            self.fastest("analysis", [{"classifier_export": path} for path in classifier])
+
+        return {
+            "host": _host(),
+            "random_weights": not (
+                self.settings["mapping_export"] or os.path.exists(config.mapping_weights)
+            ),
+            "settings": self.settings,
+            "trials": self.trials,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    tune_parser = commands.add_parser("tune", help="tune and save the profile")
+    tune_parser.add_argument("--out", default=config.tuning_profile)
+    tune_parser.add_argument("--repeat", type=int, default=10)
+    tune_parser.add_argument(
+        "--mapping-export", action="append", default=[], help="candidate mapping export"
+    )
+    tune_parser.add_argument(
+        "--classifier-export", action="append", default=[], help="candidate classifier export"
+    )
+
+    show_parser = commands.add_parser("show", help="print the saved profile")
+    show_parser.add_argument("path", nargs="?", default=config.tuning_profile)
+
+    trial_parser = commands.add_parser("trial", help=argparse.SUPPRESS)
+    trial_parser.add_argument("spec")
+
+    args = parser.parse_args()
+
+    if args.command == "trial":
+        print(json.dumps(trial(json.loads(args.spec))))
+        return
+
+    if args.command == "show":
+        with open(args.path) as f:
+            profile = json.load(f)
+        print("tuned on %(platform)s, %(cpus)d CPUs" % profile["host"])
+        for key, value in profile["settings"].items():
+            print("%-20s %s" % (key, value))
+        return
+
+    tuner = Tuner(args.repeat, args.mapping_export, args.classifier_export)
+    profile = tuner.run()
+    with open(args.out, "w") as f:
+        json.dump(profile, f, indent=2)
+    print("saved %s" % args.out)
+    for key, value in profile["settings"].items():
+        print("%-20s %s" % (key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Benchmark suite for the analysis hot paths.
+
+Every case runs in its own process and reports p50/p95 latency, the
+peak of Python/numpy allocations during one call (tracemalloc, torch
+tensors not included) and the peak RSS of its process, batchable
+cases also their throughput at several batch sizes. Pictures come
+from the local stub WMS, and the mapping model falls back to random
+weights when config.mapping_weights is missing (reported as such).
+Cases whose dependencies are missing are skipped.
+
+    python -m utils.benchmark run before.json
+    python -m utils.benchmark run after.json --only final_pred,_predict
+    python -m utils.benchmark compare before.json after.json --threshold 0.1
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import config
+
+BATCH_SIZES = (1, 4, 16)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def time_call(fn, repeat: int = 20, warmup: int = 1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": repeat,
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "peak_alloc_mb": peak / 1024**2,
+    }
+
+
+def throughput(fn, make_batch, batch_sizes=BATCH_SIZES, repeat: int = 3):
+    """
+    Images per second of fn(batch) for each batch size.
+    """
+    result = {}
+    for size in batch_sizes:
+        batch = make_batch(size)
+        stats = time_call(lambda: fn(batch), repeat=repeat)
+        result[str(size)] = size / (stats["p50_ms"] / 1000)
+    return result
+
+
+class Context:
+    """
+    Lazily built inputs shared by the cases.
+    """
+
+    def __init__(self, picture_size: int):
+        self.picture_size = picture_size
+        self._server = None
+        self._mapping_model = None
+
+    @property
+    def wms_url(self):
+        if self._server is None:
+            from utils.wms_stub import start_stub_server
+
+            self._server, url = start_stub_server()
+            # point download_picture at the stub, without the tile cache
+            config.wms_url = url
+            config.tile_cache_dir = None
+        return config.wms_url
+
+    @property
+    def jpeg(self):
+        from utils.wms_stub import render_picture
+
+        return render_picture("48.8,2.3,48.9,2.4", self.picture_size, self.picture_size)
+
+    def tile(self, size: int = 256):
+        rng = np.random.default_rng(0)
+        return rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+    @property
+    def mapping_model(self):
+        if self._mapping_model is None:
+            if os.path.exists(config.mapping_weights) or config.mapping_export:
+                from utils.model_registry import get_mapping_model
+
+                self._mapping_model = get_mapping_model()
+                self.random_weights = False
+            else:
+                from utils.unet_model import UNet
+
+                self._mapping_model = UNet(**config.mapping_model).eval()
+                self.random_weights = True
+        return self._mapping_model
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def bench_download_picture(ctx, repeat):
+    from utils.picture_fetch import download_picture
+
+    ctx.wms_url
+    with tempfile.TemporaryDirectory() as temp_dir:
+        return time_call(
+            lambda: download_picture("48.8,2.3,48.9,2.4", temp_dir + "/", ctx.picture_size),
+            repeat,
+        )
+
+
+def bench_jpeg_decode(ctx, repeat):
+    from PIL import Image
+
+    data = ctx.jpeg
+    return time_call(lambda: np.asarray(Image.open(io.BytesIO(data)).convert("RGB")), repeat)
+
+
+def bench_ingest(ctx, repeat):
+    from utils.image_ingest import decode
+
+    data = ctx.jpeg
+    return time_call(lambda: decode(data, config.model_size), repeat)
+
+
+def bench_preprocess_class(ctx, repeat):
+    from utils.picture_fetch import preprocess_class
+
+    tile = ctx.tile()
+    return time_call(lambda: preprocess_class(tile), repeat)
+
+
+def bench_classification(ctx, repeat):
+    from utils.analysis import classify_batch
+    from utils.model_registry import get_classifier
+
+    if not (config.classifier_export or os.path.exists(config.keras_model)):
+        raise FileNotFoundError(config.keras_model)
+    model = get_classifier()
+    tile = ctx.tile()
+    result = time_call(lambda: classify_batch([tile], model), repeat)
+    result["throughput"] = throughput(
+        lambda batch: classify_batch(batch, model, batch_size=len(batch)),
+        lambda size: [tile] * size,
+    )
+    return result
+
+
+def bench_preprocess(ctx, repeat):
+    from utils.map_utils import _preprocess
+
+    tile = ctx.tile()
+    return time_call(lambda: _preprocess(tile), repeat)
+
+
+def bench_predict(ctx, repeat):
+    from utils.map_utils import _predict, _predict_batch
+
+    model, tile = ctx.mapping_model, ctx.tile()
+    result = time_call(lambda: _predict(tile, model), repeat)
+    result["throughput"] = throughput(
+        lambda batch: _predict_batch(batch, model, batch_size=len(batch)),
+        lambda size: [tile] * size,
+    )
+    return result
+
+
+def bench_postprocess(ctx, repeat):
+    from utils.map_utils import _postprocess
+
+    logits = np.random.default_rng(0).normal(size=(1, 2, 256, 256)).astype(np.float32)
+    return time_call(lambda: _postprocess(logits), repeat)
+
+
+def bench_calcul_area(ctx, repeat):
+    from utils.map_utils import _calcul_area
+
+    mask = np.random.default_rng(0).integers(0, 2, (256, 256))
+    return time_call(lambda: _calcul_area(mask), repeat)
+
+
+def bench_extract_silos(ctx, repeat):
+    from utils.map_utils import extract_silos
+
+    mask = np.zeros((1024, 1024), dtype=np.int64)
+    rows, cols = np.ogrid[:1024, :1024]
+    for row, col, radius in [(200, 200, 80), (600, 700, 150), (900, 300, 60)]:
+        mask[(rows - row) ** 2 + (cols - col) ** 2 < radius**2] = 1
+    return time_call(lambda: extract_silos(mask), repeat)
+
+
+def bench_final_pred(ctx, repeat):
+    from utils.map_utils import final_pred
+
+    model, tile = ctx.mapping_model, ctx.tile()
+    return time_call(lambda: final_pred(tile, model), repeat)
+
+
+def bench_analysis(ctx, repeat):
+    # the app path from the fetched JPEG to the overlay, classifier excluded
+    from utils.image_ingest import read_image
+    from utils.map_utils import final_pred
+    from utils.picture_fetch import preprocess_class, array_to_image
+
+    model, data = ctx.mapping_model, ctx.jpeg
+
+    def analysis():
+        image = read_image(data, config.display_size)
+        input_arr = np.asarray(image.resize((config.model_size, config.model_size)))
+        preprocess_class(input_arr)
+        covered, _, _ = final_pred(input_arr, model)
+        array_to_image(covered).resize((config.display_size, config.display_size))
+
+    return time_call(analysis, repeat)
+
+
+def bench_draw_map(ctx, repeat):
+    from utils.picture_fetch import draw_map
+
+    return time_call(lambda: draw_map().get_root().render(), repeat)
+
+
+CASES = {
+    "download_picture": bench_download_picture,
+    "jpeg_decode": bench_jpeg_decode,
+    "ingest": bench_ingest,
+    "preprocess_class": bench_preprocess_class,
+    "classification": bench_classification,
+    "_preprocess": bench_preprocess,
+    "_predict": bench_predict,
+    "_postprocess": bench_postprocess,
+    "_calcul_area": bench_calcul_area,
+    "extract_silos": bench_extract_silos,
+    "final_pred": bench_final_pred,
+    "analysis": bench_analysis,
+    "draw_map": bench_draw_map,
+}
+
+
+def run_case(name: str, repeat: int = 20, picture_size: int = config.full_size):
+    """
+    Runs one case in this process, which should run nothing else, so
+    its peak RSS belongs to the case.
+    """
+    ctx = Context(picture_size)
+    try:
+        result = CASES[name](ctx, repeat)
+    except (ImportError, FileNotFoundError) as e:
+        result = {"skipped": "%s: %s" % (type(e).__name__, e)}
+    finally:
+        ctx.close()
+    result["peak_rss_mb"] = _peak_rss_mb()
+    result["random_weights"] = getattr(ctx, "random_weights", None)
+    return result
+
+
+def _run_isolated(name: str, repeat: int, picture_size: int):
+    # a fresh interpreter per case, ru_maxrss never goes down
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "utils.benchmark",
+            "case",
+            name,
+            "--repeat",
+            str(repeat),
+            "--picture-size",
+            str(picture_size),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()[-1:] or ["exit %d" % process.returncode]
+        return {"skipped": "failed: %s" % error[0]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run(names=None, repeat: int = 20, picture_size: int = config.full_size):
+    results = {}
+    for name in names or CASES:
+        result = _run_isolated(name, repeat, picture_size)
+        results[name] = result
+        print("%-18s %s" % (name, _summary(result)))
+    random_weights = [r.pop("random_weights", None) for r in results.values()]
+
+    return {
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "picture_size": picture_size,
+        "random_weights": any(random_weights),
+        "cases": results,
+    }
+
+
+def _summary(result):
+    if "skipped" in result:
+        return "skipped (%s)" % result["skipped"]
+    text = "p50 %8.2f ms  p95 %8.2f ms  alloc %7.1f MB  rss %6.0f MB" % (
+        result["p50_ms"],
+        result["p95_ms"],
+        result.get("peak_alloc_mb", float("nan")),
+        result["peak_rss_mb"],
+    )
+    if "throughput" in result:
+        text += "  " + " ".join(
+            "B=%s: %.1f/s" % item for item in result["throughput"].items()
+        )
+    return text
+
+
+def compare(before: dict, after: dict, threshold: float = 0.1):
+    """
+    Lists the regressions of after against before: p50/p95 latencies,
+    peak allocations or peak RSS more than threshold higher, or
+    throughputs more than threshold lower.
+    """
+    regressions = []
+    for name, old in before["cases"].items():
+        new = after["cases"].get(name)
+        if new is None or "skipped" in old or "skipped" in new:
+            continue
+        for key in ("p50_ms", "p95_ms", "peak_alloc_mb", "peak_rss_mb"):
+            if key in old and key in new and new[key] > old[key] * (1 + threshold):
+                regressions.append(
+                    "%s %s: %.2f -> %.2f" % (name, key, old[key], new[key])
+                )
+        for size, rate in old.get("throughput", {}).items():
+            new_rate = new.get("throughput", {}).get(size)
+            if new_rate is not None and new_rate < rate * (1 - threshold):
+                regressions.append(
+                    "%s throughput B=%s: %.1f -> %.1f /s" % (name, size, rate, new_rate)
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite")
+    run_parser.add_argument("out", help="JSON results file")
+    run_parser.add_argument("--only", default=None, help="comma separated cases")
+    run_parser.add_argument("--repeat", type=int, default=20)
+    run_parser.add_argument("--picture-size", type=int, default=config.full_size)
+
+    case_parser = commands.add_parser("case", help=argparse.SUPPRESS)
+    case_parser.add_argument("name", choices=list(CASES))
+    case_parser.add_argument("--repeat", type=int, default=20)
+    case_parser.add_argument("--picture-size", type=int, default=config.full_size)
+
+    compare_parser = commands.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == "case":
+        print(json.dumps(run_case(args.name, args.repeat, args.picture_size)))
+        return
+
+    if args.command == "run":
+        names = args.only.split(",") if args.only else None
+        results = run(names, args.repeat, args.picture_size)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        return
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if regressions:
+        raise SystemExit(1)
+    print("no regression above %d%%" % (args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Converts both models to one inference runtime and checks parity.
+
+The Keras classifier is converted with tf2onnx and the mapping UNet
+with utils/unet_export.py, then each converted model is run against
+its original on the same inputs. Point config.classifier_export and
+config.mapping_export to the written files to serve from ONNX Runtime
+only.
+
+    python -m utils.convert_models utils/ --tiles samples/
+"""
+
+import os
+import argparse
+import numpy as np
+import config
+
+
+def convert_classifier(path: str, size: int = 256):
+    import tensorflow as tf
+    import tf2onnx
+    from tensorflow import keras
+
+    model = keras.models.load_model(config.keras_model)
+    signature = [tf.TensorSpec((None, size, size, 3), tf.float32, name="image")]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=17, output_path=path)
+    return path
+
+
+def classifier_parity(path: str, batch: np.ndarray, atol: float = None):
+    """
+    Max absolute difference between the Keras and the converted
+    classifier probabilities on a [B, H, W, C] batch. Raises
+    ValueError when it is above atol, if given.
+    """
+    from utils.inference_engine import load_engine
+    from utils.picture_fetch import preprocess_class
+
+    batch = preprocess_class(batch)
+    reference = load_engine(config.keras_model).predict(batch)
+    converted = load_engine(path).predict(batch)
+    diff = float(np.abs(reference - converted).max())
+    if atol is not None and diff > atol:
+        raise ValueError(
+            "converted classifier differs from %s: max |probability diff| "
+            "%.2e > %.2e" % (config.keras_model, diff, atol)
+        )
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir", help="folder for the .onnx files")
+    parser.add_argument("--tiles", default=None, help="folder of sample tiles")
+    parser.add_argument("--size", type=int, default=config.model_size)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    from utils.model_eval import load_tiles
+    from utils.model_registry import _load_eager_mapping_model
+    from utils.unet_export import export, compare, load_exported
+
+    if args.tiles:
+        batch = np.stack(load_tiles(args.tiles, size=args.size, limit=16))
+    else:
+        batch = np.random.uniform(0, 255, (8, args.size, args.size, 3))
+    batch = batch.astype(np.float32)
+
+    classifier_path = convert_classifier(
+        os.path.join(args.out_dir, "class_model.onnx"), args.size
+    )
+    classifier_diff = classifier_parity(classifier_path, batch, args.atol)
+    print("classifier: max |probability diff| %.2e" % classifier_diff)
+
+    mapping_path = os.path.join(args.out_dir, "mapping_model.onnx")
+    model = _load_eager_mapping_model()
+    export(model, mapping_path, args.size)
+    report = compare(model, load_exported(mapping_path), args.size)
+    print(
+        "mapping:    max |logit diff| %.2e, mask agreement %.4f"
+        % (report["max_abs_diff"], report["mask_agreement"])
+    )
+
+    if report["max_abs_diff"] > args.atol:
+        raise SystemExit("converted mapping model differs from the original")
+    print('classifier_export = "%s"' % classifier_path)
+    print('mapping_export = "%s"' % mapping_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Image ingest shared by the app and the batch tools.
+
+Sources can be bytes (e.g. fetch_picture), paths, or file-likes such
+as st.sidebar.file_uploader uploads. When the target size is much
+smaller than a JPEG source, the decoder is put in draft mode and
+downscales by 1/2, 1/4 or 1/8 in the DCT domain, so a 4000x4000
+orthophoto is never decoded at full size for a 256x256 model input.
+"""
+
+import io
+import os
+import numpy as np
+from PIL import Image
+
+
+def _size(size):
+    return (size, size) if isinstance(size, int) else tuple(size)
+
+
+def open_image(source):
+    """
+    Lazily opens bytes, a path or a file-like object with PIL.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    if isinstance(source, (str, os.PathLike)):
+        return Image.open(source)
+    if hasattr(source, "seek"):
+        source.seek(0)  # uploads may have been read before
+    return Image.open(source)
+
+
+def read_image(source, size=None, resample=Image.BILINEAR):
+    """
+    Decodes source to an RGB PIL image, resized to size (an int for
+    square images or a (width, height) tuple) when given.
+    """
+    with open_image(source) as image:
+        if size is not None:
+            size = _size(size)
+            # JPEG only: the decoder picks the smallest scale >= size
+            image.draft("RGB", size)
+        image = image.convert("RGB")
+    if size is not None and image.size != size:
+        image = image.resize(size, resample)
+    return image
+
+
+def decode(source, size=None, out: np.ndarray = None):
+    """
+    Decodes source to a [H, W, 3] uint8 array, resized to size when
+    given, written into out if given (e.g. a row of a batch buffer).
+    """
+    image = read_image(source, size)
+    if out is None:
+        return np.asarray(image)
+    np.copyto(out, np.asarray(image))
+    return out
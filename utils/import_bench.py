@@ -0,0 +1,72 @@
+"""
+Cold import time of the app and headless tools.
+
+Each module is imported in a fresh interpreter, repeat times, and the
+median wall time is reported together with the heavy frameworks the
+import dragged in (there should be none).
+
+    python -m utils.import_bench
+    python -m utils.import_bench utils.region_scan --repeat 10
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+MODULES = [
+    "utils.picture_fetch",
+    "utils.model_registry",
+    "utils.region_scan",
+    "utils.wms_fetch",
+]
+
+HEAVY = ["tensorflow", "keras", "torch", "torchvision", "folium", "pandas"]
+
+_PROBE = """
+import sys, json, importlib
+importlib.import_module(%r)
+print(json.dumps([m for m in %r if m in sys.modules]))
+"""
+
+
+def time_import(module: str, repeat: int = 5):
+    """
+    Returns the median seconds to import module in a new interpreter,
+    on top of the interpreter start-up, and the heavy modules it loaded.
+    """
+
+    def run(code):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        return time.perf_counter() - start, out
+
+    baseline = statistics.median(run("pass")[0] for _ in range(repeat))
+    timings = []
+    for _ in range(repeat):
+        seconds, out = run(_PROBE % (module, HEAVY))
+        timings.append(seconds)
+    loaded = json.loads(out.strip().splitlines()[-1])
+    return statistics.median(timings) - baseline, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        seconds, loaded = time_import(module, args.repeat)
+        print(
+            "%-24s %7.0f ms  heavy: %s"
+            % (module, seconds * 1000, ", ".join(loaded) or "-")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Inference engines with pluggable backends.
+
+An engine wraps a model behind one method, predict(batch) -> array,
+with numpy arrays in and out, so callers do not care which runtime
+serves it. Both the silo classifier ([B, H, W, C] in, [B, 1] out) and
+the mapping model ([B, C, H, W] in, logits out) can be served by the
+same runtime once converted with utils/convert_models.py, e.g. ONNX
+Runtime, so a serving process imports neither TensorFlow nor torch.
+
+The backend is picked from the file extension:
+
+    .h5 / .keras  -> KerasEngine        (TensorFlow)
+    .pt           -> TorchScriptEngine  (torch)
+    .onnx         -> OnnxEngine         (onnxruntime)
+"""
+
+import os
+import abc
+import numpy as np
+
+
+class Engine(abc.ABC):
+    # model file, None for in-memory models
+    path = None
+
+    @abc.abstractmethod
+    def predict(self, batch: np.ndarray):
+        """
+        Runs a batch through the model, numpy array in and out.
+        """
+
+
+class KerasEngine(Engine):
+    def __init__(
+        self, path: str, threads: int = 0, interop_threads: int = 0, batch_size: int = 32
+    ):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        try:
+            if threads:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+            if interop_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(interop_threads)
+        except RuntimeError:
+            pass  # TensorFlow already initialised, keep its pools
+        self.path = path
+        self.batch_size = batch_size
+        self.model = keras.models.load_model(path)
+
+    def predict(self, batch: np.ndarray):
+        return self.model.predict(batch, batch_size=self.batch_size, verbose=0)
+
+
+class TorchEngine(Engine):
+    """
+    Serves an in-memory torch module, e.g. the eager UNet.
+    """
+
+    def __init__(self, model, threads: int = 0, interop_threads: int = 0):
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError:
+                pass  # parallel work already started, keep the pool
+        self.model = model.eval()
+
+    def predict(self, batch: np.ndarray):
+        import torch
+
+        with torch.no_grad():
+            return self.model(torch.from_numpy(batch)).numpy()
+
+
+class TorchScriptEngine(TorchEngine):
+    def __init__(self, path: str, threads: int = 0, interop_threads: int = 0):
+        import torch
+
+        model = torch.jit.load(path, map_location="cpu")
+        # host specific optimisations cannot be serialised, apply them on load
+        super().__init__(torch.jit.optimize_for_inference(model), threads, interop_threads)
+        self.path = path
+
+
+class OnnxEngine(Engine):
+    def __init__(self, path: str, threads: int = 0, interop_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = interop_threads
+        self.path = path
+        self.session = ort.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+BACKENDS = {
+    ".h5": KerasEngine,
+    ".keras": KerasEngine,
+    ".pt": TorchScriptEngine,
+    ".onnx": OnnxEngine,
+}
+
+
+def load_engine(path: str, **kwargs):
+    """
+    Loads the model file at path with the backend matching its extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in BACKENDS:
+        raise ValueError(
+            "no inference backend for %s, expected one of %s" % (path, list(BACKENDS))
+        )
+    return BACKENDS[extension](path, **kwargs)
@@ -0,0 +1,158 @@
+"""
+Cross-session micro-batching of model calls.
+
+Streamlit runs every session in its own script thread. Instead of each
+of them calling the models with a batch of one, sessions submit their
+picture to a shared queue and get a concurrent.futures.Future back. A
+worker thread per model takes the first waiting request, gathers more
+for at most config.batch_max_wait seconds or until it has
+config.classify_batch_size / segment_batch_size requests, and runs them
+through the model in one call.
+
+    probability = classify(picture).result()
+    mask = segment(picture).result()
+
+A lone user waits at most batch_max_wait more than before, while many
+concurrent users share batched forward passes instead of fighting for
+the CPU one picture at a time. Even with a batch size of 1 the queue
+serialises model calls, which beats oversubscribed concurrent ones.
+"""
+
+import time
+import queue
+import threading
+import concurrent.futures
+import numpy as np
+import config
+from utils.instrumentation import count, span
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Runs fn(list of items) -> list of results over dynamic batches of
+    submitted items, in a daemon worker thread.
+    """
+
+    def __init__(self, fn, max_size: int = 16, max_wait: float = 0.01, name: str = "batch"):
+        self.fn = fn
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.name = name
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=name)
+        self._thread.start()
+
+    def submit(self, item):
+        future = concurrent.futures.Future()
+        self._requests.put((item, future))
+        return future
+
+    def close(self):
+        self._requests.put(_STOP)
+        self._thread.join()
+
+    def _collect(self):
+        # block for the first request, then gather more until the deadline
+        first = self._requests.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is _STOP:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            # drop requests whose caller cancelled in the meantime
+            batch = [(item, f) for item, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            count(self.name + "_batches")
+            count(self.name + "_requests", len(batch))
+            try:
+                with span(self.name, size=len(batch)):
+                    results = self.fn([item for item, _ in batch])
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+
+def _classify(imgs):
+    from utils.analysis import classify_batch
+    from utils.model_registry import get_classifier
+
+    return classify_batch(imgs, get_classifier(), batch_size=len(imgs))
+
+
+def _segment(imgs):
+    from utils.map_utils import _predict_batch
+    from utils.model_registry import get_mapping_model
+
+    # pictures of different sizes cannot share a forward pass
+    masks = [None] * len(imgs)
+    by_shape = {}
+    for i, img in enumerate(imgs):
+        by_shape.setdefault(np.shape(img), []).append(i)
+    for indices in by_shape.values():
+        batch = _predict_batch(
+            [imgs[i] for i in indices], get_mapping_model(), batch_size=len(indices)
+        )
+        for i, mask in zip(indices, batch):
+            masks[i] = mask
+    return masks
+
+
+_batchers = {}
+_lock = threading.Lock()
+_functions = {
+    "classify_queue": (_classify, "classify_batch_size"),
+    "segment_queue": (_segment, "segment_batch_size"),
+}
+
+
+def get_batcher(name: str):
+    """
+    Returns the named process-wide MicroBatcher, started on first use.
+    """
+    if name not in _batchers:
+        with _lock:
+            if name not in _batchers:
+                fn, size_setting = _functions[name]
+                _batchers[name] = MicroBatcher(
+                    fn, getattr(config, size_setting), config.batch_max_wait, name
+                )
+    return _batchers[name]
+
+
+def classify(img: np.ndarray):
+    """
+    Future of the silo probability of a [H, W, C] picture in [0, 255].
+    """
+    return get_batcher("classify_queue").submit(img)
+
+
+def segment(img: np.ndarray):
+    """
+    Future of the [H, W] silo mask of a [H, W, C] picture.
+    """
+    return get_batcher("segment_queue").submit(img)
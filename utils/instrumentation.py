@@ -0,0 +1,174 @@
+"""
+Lightweight per-stage timing and metrics.
+
+    with span("fetch", bbox=bbox) as s:
+        data = fetch_picture(bbox)
+        s.set(bytes=len(data))
+    count("tile_cache_hits")
+
+When config.metrics_enabled is off, span returns a shared no-op
+context manager and count returns straight away, so instrumented
+code pays one attribute lookup. When on, every span is logged as a
+JSON line on the "foodix.metrics" logger and aggregated per name;
+the aggregates are exposed in the Prometheus text format, written
+to config.metrics_file and/or served on config.metrics_port.
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import config
+
+logger = logging.getLogger("foodix.metrics")
+
+_lock = threading.Lock()
+_spans = {}  # name -> [count, total seconds, max seconds]
+_counters = {}  # name -> value
+_server = None
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            stat = _spans.setdefault(self.name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+        record = {"span": self.name, "seconds": round(seconds, 6), **self.attrs}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        logger.info(json.dumps(record, default=str))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """
+    Times the enclosed block under name, attrs are added to its log line.
+    """
+    if not config.metrics_enabled:
+        return _NOOP
+    return _Span(name, attrs)
+
+
+def count(name: str, value: float = 1):
+    """
+    Adds value to the counter name, e.g. bytes fetched or cache hits.
+    """
+    if not config.metrics_enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def enable(enabled: bool = True):
+    config.metrics_enabled = enabled
+    if enabled and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+def snapshot():
+    with _lock:
+        return {name: list(stat) for name, stat in _spans.items()}, dict(_counters)
+
+
+def prometheus_text():
+    spans, counters = snapshot()
+    lines = [
+        "# TYPE foodix_span_seconds summary",
+    ]
+    for name, (n, total, _) in sorted(spans.items()):
+        lines.append('foodix_span_seconds_sum{span="%s"} %.6f' % (name, total))
+        lines.append('foodix_span_seconds_count{span="%s"} %d' % (name, n))
+    lines.append("# TYPE foodix_span_seconds_max gauge")
+    for name, (_, _, longest) in sorted(spans.items()):
+        lines.append('foodix_span_seconds_max{span="%s"} %.6f' % (name, longest))
+    for name, value in sorted(counters.items()):
+        lines.append("# TYPE foodix_%s_total counter" % name)
+        lines.append("foodix_%s_total %s" % (name, value))
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = None):
+    """
+    Atomically writes the metrics to path, by default config.metrics_file,
+    e.g. for the node exporter textfile collector.
+    """
+    path = path or config.metrics_file
+    if not config.metrics_enabled or not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(prometheus_text())
+    os.replace(temp_path, path)
+
+
+def start_metrics_server(port: int = None, host: str = None):
+    """
+    Serves the metrics on http://host:port/metrics (config.metrics_host
+    and metrics_port) from a daemon thread, once per process.
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    port = port or config.metrics_port
+    host = host or config.metrics_host
+    with _lock:
+        if _server is not None or not config.metrics_enabled or not port:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+if config.metrics_enabled:
+    enable()
@@ -0,0 +1,124 @@
+"""
+Precomputed region layer for draw_map.
+
+Region outlines from data/regions.geojson are simplified for a zoom
+level (Douglas-Peucker with a tolerance of about half a screen pixel),
+coordinates are quantised to the matching number of decimals and the
+food production index of data/regions_data.csv is baked into each
+feature. Layers are built once per process and rebuilt only when one
+of the source files changes.
+"""
+
+import os
+import csv
+import json
+import math
+import functools
+import numpy as np
+
+GEOJSON_PATH = "data/regions.geojson"
+DATA_PATH = "data/regions_data.csv"
+
+
+def _simplify(ring: np.ndarray, tolerance: float):
+    # iterative Douglas-Peucker, keeps the first and last point
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = ring[start], ring[end]
+        points = ring[start + 1 : end] - a
+        ab = b - a
+        if (length := np.hypot(*ab)) == 0:
+            dist = np.hypot(points[:, 0], points[:, 1])
+        else:
+            dist = np.abs(points[:, 0] * ab[1] - points[:, 1] * ab[0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            stack.append((start, start + 1 + i))
+            stack.append((start + 1 + i, end))
+            keep[start + 1 + i] = True
+    return ring[keep]
+
+
+def _simplify_polygon(polygon: list, tolerance: float, decimals: int):
+    rings = []
+    for i, ring in enumerate(polygon):
+        ring = np.round(_simplify(np.asarray(ring), tolerance), decimals)
+        if len(ring) >= 4:
+            rings.append(ring.tolist())
+        elif i == 0:
+            # the outer ring vanishes at this zoom, and its holes with it
+            return []
+    return rings
+
+
+def zoom_tolerance(zoom: float):
+    """
+    Half the width of a 256 pixel web map tile pixel, in degrees.
+    """
+    return 360 / (256 * 2**zoom) / 2
+
+
+def _food_production(data_path: str):
+    with open(data_path, encoding="utf-8") as f:
+        return {row["Regions"]: float(row["Food Production"]) for row in csv.DictReader(f)}
+
+
+@functools.lru_cache(maxsize=16)
+def _build_layer(zoom: int, geojson_path: str, data_path: str, mtimes: tuple):
+    tolerance = zoom_tolerance(zoom)
+    decimals = max(0, math.ceil(-math.log10(tolerance))) + 1
+    production = _food_production(data_path)
+
+    with open(geojson_path, encoding="utf-8") as f:
+        regions = json.load(f)
+
+    features = []
+    for feature in regions["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+
+        simplified = [_simplify_polygon(p, tolerance, decimals) for p in polygons]
+        simplified = [p for p in simplified if p]
+        if not simplified:
+            # keep tiny regions visible rather than dropping them
+            simplified = [_simplify_polygon(polygons[0], 0, decimals)]
+
+        name = feature["properties"]["Region"]
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {
+                    "Region": name,
+                    "Food Production": production.get(name),
+                },
+                "geometry": {"type": "MultiPolygon", "coordinates": simplified},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def region_layer(zoom: float, geojson_path: str = GEOJSON_PATH, data_path: str = DATA_PATH):
+    """
+    Simplified region GeoJSON for a zoom level, with the food production
+    index of each region in its properties. Cached until a source file changes.
+    """
+    mtimes = (os.path.getmtime(geojson_path), os.path.getmtime(data_path))
+    return _build_layer(int(math.floor(zoom)), geojson_path, data_path, mtimes)
+
+
+def main():
+    raw = os.path.getsize(GEOJSON_PATH)
+    for zoom in range(4, 12, 2):
+        size = len(json.dumps(region_layer(zoom), separators=(",", ":")))
+        print("zoom %2d: %8d bytes (%.0fx smaller)" % (zoom, size, raw / size))
+
+
+if __name__ == "__main__":
+    main()
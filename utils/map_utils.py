@@ -1,46 +1,313 @@
-import torch
 import numpy as np
+import config
+from utils.instrumentation import span
 
 
 def _preprocess(img: np.ndarray):
-    img = np.moveaxis(img, -1, 0)  # from [H, W, C] to [C, H, W]
-    img = (img - np.min(img)) / np.ptp(img)  # linear scaling to range [0-1]
-    img = np.expand_dims(img, axis=0)  # add batch dimension [B, C, H, W]
-    img = img.astype(np.float32)  # typecasting to float32
-    return img
+    return _preprocess_batch([img])  # [1, C, H, W]
+
+
+def _scale_into(out: np.ndarray, img: np.ndarray, low=None, high=None):
+    # [H, W, C] pixels, uint8 or float, to [C, H, W] float32 in [0, 1].
+    # every pixel is converted once while copying, then scaled in place
+    np.copyto(out, np.moveaxis(img, -1, 0), casting="unsafe")
+    low = img.min() if low is None else low
+    high = img.max() if high is None else high
+    out -= low
+    if high > low:
+        out *= 1 / (float(high) - float(low))  # linear scaling to range [0-1]
+    return out
+
 
+def _preprocess_batch(imgs, out: np.ndarray = None):
+    """
+    Scales a list of equally sized [H, W, C] images, uint8 or float,
+    into one [B, C, H, W] float32 batch, out if given. Scaling is per
+    image min/max, so images need not be divided by 255 beforehand.
+    """
+    height, width, channels = np.shape(imgs[0])
+    if out is None:
+        out = np.empty((len(imgs), channels, height, width), dtype=np.float32)
+    for img, x in zip(imgs, out):
+        _scale_into(x, np.asarray(img))
+    return out
 
-def _postprocess(img: torch.tensor):
-    img = torch.argmax(img, dim=1)  # perform argmax to generate 1 channel
-    img = img.cpu().numpy()  # send to cpu and transform to numpy.ndarray
+
+def _labels(logits: np.ndarray, axis: int):
+    # class of every pixel as uint8, without the int64 argmax array
+    # when there are only two classes
+    if logits.shape[axis] == 2:
+        first, second = np.moveaxis(logits, axis, 0)
+        return (second > first).view(np.uint8)
+    return np.argmax(logits, axis=axis).astype(np.uint8)
+
+
+def _postprocess(img: np.ndarray):
+    img = _labels(img, axis=1)  # perform argmax to generate 1 channel
     img = np.squeeze(img)  # remove batch dim and channel dim -> [H, W]
 
     return img
 
 
+def _forward(x: np.ndarray, model, device=None):
+    """
+    Runs a [B, C, H, W] float32 batch through the mapping model and
+    returns the logits as a numpy array. model is either a torch module
+    or an inference engine from utils.inference_engine, which needs no torch.
+    """
+    with span("forward", shape=x.shape):
+        if hasattr(model, "predict"):
+            return model.predict(x)
+
+        import torch
+
+        model.eval()
+        device = torch.device("cpu") if device is None else device
+        x = torch.from_numpy(x).to(device)  # to torch, send to device
+        if config.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        no_grad = torch.inference_mode if config.inference_mode else torch.no_grad
+        with no_grad():
+            out = model(x)  # send through model/network
+        return out.cpu().numpy()
+
+
 def _predict(
     img,
     model,
-    device,
+    device=None,
 ):
-    model.eval()
     img = _preprocess(img)  # preprocess image
-    x = torch.from_numpy(img).to(device)  # to torch, send to device
-    with torch.no_grad():
-        out = model(x)  # send through model/network
+    out = _forward(img, model, device)
 
-    out_softmax = torch.softmax(out, dim=1)  # perform softmax on outputs
-    result = _postprocess(out_softmax)
+    # softmax is monotonic, the argmax of the logits gives the same mask
+    result = _postprocess(out)
     return result
 
 
-def _calcul_area(array: np.array, size: int = 256):
-    inputs = array.flatten()
-    nb = sum(inputs)
-    if size == 128:
-        return nb
+def _predict_batch(
+    imgs,
+    model,
+    device=None,
+    batch_size: int = 16,
+):
+    """
+    Segments a list of equally sized [H, W, C] images, batch_size
+    images per forward pass. Returns the masks as a [B, H, W] array,
+    empty for an empty list.
+    """
+    if len(imgs) == 0:
+        return np.empty((0, 0, 0), dtype=np.uint8)
+    imgs = _preprocess_batch(imgs)
+
+    masks = []
+    for i in range(0, len(imgs), batch_size):
+        out = _forward(imgs[i : i + batch_size], model, device)
+        masks.append(_labels(out, axis=1))
+    return np.concatenate(masks)
+
+
+def _tile_starts(length: int, tile_size: int, stride: int):
+    # window offsets along one axis, the last window is flush with the border
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def _blend_weights(tile_size: int, overlap: int):
+    # linear ramp towards the window border so overlapping logits cross-fade
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def _predict_tiled(
+    img,
+    model,
+    device=None,
+    tile_size: int = 256,
+    overlap: int = 32,
+    batch_size: int = 8,
+):
+    """
+    Segments an image of any size by running the model on overlapping
+    tile_size windows, batch_size windows at a time, and blending the
+    logits back into a single [H, W] mask. Only the windows of a batch
+    are converted to float, the image itself stays as it is.
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError(
+            "overlap must be in [0, tile_size=%d), got %d" % (tile_size, overlap)
+        )
+    img = np.asarray(img)
+    height, width, channels = img.shape
+    low, high = img.min(), img.max()  # scaling of the whole image
+
+    # pad images smaller than one window
+    pad_h, pad_w = max(tile_size - height, 0), max(tile_size - width, 0)
+    if pad_h or pad_w:
+        img = np.pad(img, ((0, pad_h), (0, pad_w), (0, 0)), mode="edge")
+    full_h, full_w = img.shape[:2]
+
+    stride = tile_size - overlap
+    windows = [
+        (y, x)
+        for y in _tile_starts(full_h, tile_size, stride)
+        for x in _tile_starts(full_w, tile_size, stride)
+    ]
+    weights = _blend_weights(tile_size, overlap)
+
+    logits = None
+    batch = np.empty((batch_size, channels, tile_size, tile_size), dtype=np.float32)
+    for i in range(0, len(windows), batch_size):
+        chunk = windows[i : i + batch_size]
+        for j, (y, x) in enumerate(chunk):
+            _scale_into(batch[j], img[y : y + tile_size, x : x + tile_size], low, high)
+
+        out = _forward(batch[: len(chunk)], model, device)
+        if out.shape[1] == 2:
+            # with two classes only the margin between them decides the argmax
+            out = out[:, 1:] - out[:, :1]
+
+        if logits is None:
+            logits = np.zeros((out.shape[1], full_h, full_w), dtype=np.float32)
+        for j, (y, x) in enumerate(chunk):
+            logits[:, y : y + tile_size, x : x + tile_size] += out[j] * weights
+
+    # weights are positive, so the argmax of the weighted sum equals
+    # the argmax of the weighted mean
+    if len(logits) == 1:
+        mask = (logits[0] > 0).view(np.uint8)
     else:
-        return nb * 0.25
+        mask = _labels(logits, axis=0)
+    return mask[:height, :width]
+
+
+def _pixel_area(shape, size=None):
+    # a picture covers 128x128 meters whatever its resolution or aspect
+    # ratio, so each axis has its own scale. size is the side of a square
+    # picture or its (height, width), by default shape
+    if size is None:
+        size = shape[:2]
+    height, width = (size, size) if np.isscalar(size) else size
+    return (128 / height) * (128 / width)
+
+
+def _calcul_area(array: np.array, size=None):
+    nb = np.count_nonzero(array)
+    return nb * _pixel_area(np.shape(array), size)
+
+
+def _runs(mask: np.ndarray):
+    # horizontal runs of foreground pixels as (row, start, end) arrays,
+    # ordered row by row, end exclusive
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask != 0
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def _touching_runs(rows, starts, ends, width: int, connectivity: int):
+    # pairs (i, j) of runs where run i, one row above run j, touches it.
+    # runs are sorted by (row, start) and disjoint within a row, so
+    # keys row * stride + column are sorted and the runs of the row
+    # above that overlap run j form the index range [low, high)
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    above = (rows - 1) * stride
+    reach = 1 if connectivity == 8 else 0  # diagonal neighbours
+
+    low = np.searchsorted(end_keys, above + starts - reach, side="right")
+    high = np.searchsorted(start_keys, above + ends - 1 + reach, side="right")
+    n = np.clip(high - low, 0, None)
+    n[rows == 0] = 0
+
+    below = np.repeat(np.arange(len(rows)), n)
+    offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return np.repeat(low, n) + offsets, below
+
+
+def _label_runs(n_runs: int, a: np.ndarray, b: np.ndarray):
+    # connected components of the run graph, hooking the larger root onto
+    # the smaller one and compressing paths until every edge is settled
+    parent = np.arange(n_runs)
+    while True:
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            break
+        root_a, root_b = root_a[differ], root_b[differ]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def extract_silos(
+    mask: np.ndarray, size: int = None, min_pixels: int = 1, connectivity: int = 4
+):
+    """
+    Splits a [H, W] mask into connected silos. Returns one dict per silo,
+    top to bottom, with its pixel count, area in square meters, size
+    category, bounding box (row0, col0, row1, col1), end exclusive, and
+    centroid (row, col). size is the side of the 128 x 128 m picture, or
+    its (height, width), by default the mask shape. Works on pixel runs,
+    so the cost follows the outline of the silos rather than the number
+    of pixels.
+    """
+    rows, starts, ends = _runs(mask)
+    if len(rows) == 0:
+        return []
+
+    a, b = _touching_runs(rows, starts, ends, mask.shape[1], connectivity)
+    labels = _label_runs(len(rows), a, b)
+    n_silos = labels.max() + 1
+
+    lengths = ends - starts
+    pixels = np.bincount(labels, weights=lengths, minlength=n_silos)
+    row_sum = np.bincount(labels, weights=lengths * rows, minlength=n_silos)
+    col_sum = np.bincount(
+        labels, weights=lengths * (starts + ends - 1) / 2, minlength=n_silos
+    )
+
+    row0 = np.full(n_silos, mask.shape[0])
+    col0 = np.full(n_silos, mask.shape[1])
+    row1 = np.zeros(n_silos, dtype=int)
+    col1 = np.zeros(n_silos, dtype=int)
+    np.minimum.at(row0, labels, rows)
+    np.minimum.at(col0, labels, starts)
+    np.maximum.at(row1, labels, rows + 1)
+    np.maximum.at(col1, labels, ends)
+
+    pixel_area = _pixel_area(mask.shape, size)
+    silos = []
+    for i in np.flatnonzero(pixels >= min_pixels):
+        area = float(pixels[i] * pixel_area)
+        silos.append(
+            {
+                "pixels": int(pixels[i]),
+                "area": area,
+                "category": _group(area),
+                "bbox": (int(row0[i]), int(col0[i]), int(row1[i]), int(col1[i])),
+                "centroid": (
+                    float(row_sum[i] / pixels[i]),
+                    float(col_sum[i] / pixels[i]),
+                ),
+            }
+        )
+    return silos
 
 
 def _group(x):
@@ -54,18 +321,51 @@ def _group(x):
         return "huge"
 
 
-def final_pred(img, model, device):
-    # predict mask
-    mask = _predict(img, model, device)
+def predict_mask(
+    img,
+    model,
+    device=None,
+    tiled: bool = False,
+    tile_size: int = 256,
+    overlap: int = 32,
+    batch_size: int = 8,
+):
+    # predict mask, either in one pass or window by window
+    # at the native resolution of the image
+    with span("final_pred.predict", shape=img.shape, tiled=tiled):
+        if tiled:
+            return _predict_tiled(img, model, device, tile_size, overlap, batch_size)
+        return _predict(img, model, device)
+
+
+def final_pred(
+    img,
+    model,
+    device=None,
+    tiled: bool = False,
+    tile_size: int = 256,
+    overlap: int = 32,
+    batch_size: int = 8,
+):
+    mask = predict_mask(img, model, device, tiled, tile_size, overlap, batch_size)
+    return summarise(img, mask)
+
 
+def summarise(img, mask):
+    """
+    Returns a copy of img, of the same dtype, with the silo pixels of
+    mask blacked out, the silo area in square meters and its size category.
+    """
     # calculate area of mask
-    area = _calcul_area(mask)
+    with span("final_pred.area"):
+        area = _calcul_area(mask)
 
     # group area
     category = _group(area)
 
     # create image where mask is black
-    covered = img + np.repeat(mask[:, :, np.newaxis], 3, axis=2)
-    covered[covered > 1] = 0
+    with span("final_pred.overlay"):
+        covered = np.array(img, copy=True)
+        covered[mask != 0] = 0
 
     return covered, area, category
@@ -0,0 +1,95 @@
+"""
+Shared evaluation harness for mapping model variants.
+
+Compares a candidate model (exported, quantized, pruned...) with the
+reference UNet on a folder of sample tiles: latency per image, size
+of the serialised model, mask IoU and drift of the estimated area.
+"""
+
+import io
+import os
+import time
+import numpy as np
+import torch
+from utils.image_ingest import decode
+from utils.inference_engine import Engine
+from utils.map_utils import _predict, _calcul_area
+
+
+def load_tiles(folder: str, size: int = 256, limit: int = None):
+    """
+    Reads the images of a folder as [size, size, 3] uint8 arrays.
+    """
+    names = sorted(
+        name
+        for name in os.listdir(folder)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".tif", ".tiff"))
+    )
+    tiles = []
+    for name in names[:limit]:
+        tiles.append(decode(os.path.join(folder, name), size))
+    if not tiles:
+        raise ValueError("no images found in %s" % folder)
+    return tiles
+
+
+def model_bytes(model):
+    """
+    Size of the serialised model, TorchScript modules included.
+    """
+    if getattr(model, "path", None):  # inference engine
+        return os.path.getsize(model.path)
+    if isinstance(model, Engine):  # serving an in-memory model
+        model = model.model
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+    else:
+        torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _masks(model, tiles, device):
+    masks, timings = [], []
+    for tile in tiles:
+        start = time.perf_counter()
+        masks.append(_predict(tile, model, device))
+        timings.append(time.perf_counter() - start)
+    return masks, float(np.median(timings))
+
+
+def compare_models(reference, candidate, tiles, device=None):
+    """
+    Runs both models over the tiles and returns a dict report.
+    IoU is 1 on tiles where both masks are empty.
+    """
+    # one untimed pass each so lazy initialisation does not count
+    _predict(tiles[0], reference, device)
+    _predict(tiles[0], candidate, device)
+
+    ref_masks, ref_time = _masks(reference, tiles, device)
+    cand_masks, cand_time = _masks(candidate, tiles, device)
+
+    ious, drifts = [], []
+    for ref, cand in zip(ref_masks, cand_masks):
+        union = np.count_nonzero(ref | cand)
+        ious.append(np.count_nonzero(ref & cand) / union if union else 1.0)
+        drifts.append(_calcul_area(cand) - _calcul_area(ref))
+
+    return {
+        "tiles": len(tiles),
+        "reference_ms": ref_time * 1000,
+        "candidate_ms": cand_time * 1000,
+        "speedup": ref_time / cand_time,
+        "reference_mb": model_bytes(reference) / 1e6,
+        "candidate_mb": model_bytes(candidate) / 1e6,
+        "mean_iou": float(np.mean(ious)),
+        "min_iou": float(np.min(ious)),
+        "mean_area_drift_m2": float(np.mean(drifts)),
+        "mean_abs_area_drift_m2": float(np.mean(np.abs(drifts))),
+    }
+
+
+def print_report(report: dict):
+    for key, value in report.items():
+        print("%-24s %s" % (key, "%.4g" % value if isinstance(value, float) else value))
@@ -0,0 +1,121 @@
+"""
+Process-wide model registry.
+
+Models are loaded lazily on first use and then shared by every
+Streamlit session and rerun, as well as by the headless tools.
+The classifier is served through an inference engine, and so is the
+mapping model once exported; see utils/inference_engine.py.
+Imported modules survive Streamlit reruns, so state kept here does too.
+"""
+
+import threading
+import config
+from utils.autotune import apply_profile
+
+_models = {}
+_lock = threading.Lock()
+
+# settings tuned for this host by utils/autotune.py, if any
+apply_profile()
+
+
+def _load_classifier():
+    from utils.inference_engine import load_engine
+
+    path = config.classifier_export or config.keras_model
+    return load_engine(
+        path, threads=config.inference_threads, interop_threads=config.interop_threads
+    )
+
+
+def _load_eager_mapping_model():
+    import torch
+    from utils.unet_model import UNet
+
+    model = UNet(**config.mapping_model)
+    model.load_state_dict(torch.load(config.mapping_weights, map_location="cpu"))
+    return _tune_eager(model)
+
+
+def _tune_eager(model):
+    # thread pools and memory format of an eager torch model, from config
+    import torch
+
+    if config.inference_threads:
+        torch.set_num_threads(config.inference_threads)
+    if config.interop_threads:
+        try:
+            torch.set_num_interop_threads(config.interop_threads)
+        except RuntimeError:
+            pass  # parallel work already started, keep the pool
+    if config.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model.eval()
+
+
+def _load_mapping_model():
+    if config.mapping_export:
+        from utils.inference_engine import load_engine
+
+        return load_engine(
+            config.mapping_export,
+            threads=config.inference_threads,
+            interop_threads=config.interop_threads,
+        )
+    return _load_eager_mapping_model()
+
+
+_loaders = {
+    "classifier": _load_classifier,
+    "mapping": _load_mapping_model,
+}
+
+
+def get_model(name: str):
+    """
+    Returns the named model, loading it on the first call only.
+    """
+    if name not in _models:
+        with _lock:
+            if name not in _models:
+                _models[name] = _loaders[name]()
+    return _models[name]
+
+
+def use_model_files(class_model: str = None, mapping_weights: str = None):
+    """
+    Overrides the configured model files, e.g. from command line flags,
+    before the models are loaded. None keeps the config.py setting.
+    """
+    with _lock:
+        if class_model:
+            config.classifier_export = class_model
+            _models.pop("classifier", None)
+        if mapping_weights:
+            # eager weights replace an exported mapping model
+            config.mapping_weights = mapping_weights
+            config.mapping_export = None
+            _models.pop("mapping", None)
+
+
+def get_classifier():
+    return get_model("classifier")
+
+
+def get_mapping_model():
+    return get_model("mapping")
+
+
+def warm_up(background: bool = False):
+    """
+    Loads every model up front. With background=True loading happens in
+    a daemon thread and callers of get_model wait for it if needed.
+    """
+    if all(name in _models for name in _loaders):
+        return None
+    if background:
+        thread = threading.Thread(target=warm_up, daemon=True)
+        thread.start()
+        return thread
+    for name in _loaders:
+        get_model(name)
@@ -1,23 +1,71 @@
-import urllib.request
+import threading
 import numpy as np
 from PIL import Image
-import folium
-from folium.plugins import Draw
-import pandas as pd
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-
-def draw_map():
-    m = folium.Map(location=[47.0810, 4.3988], zoom_start=5.7)
-
-    # read data on food production in France
-    data = pd.read_csv("data/regions_data.csv")
-    folium.Choropleth(
-        geo_data="data/regions.geojson",
-        data=data,
-        columns=("Regions", "Food Production"),
-        key_on="feature.properties.Region",
-        legend_name="Food Index",
-    ).add_to(m)
+import config
+from utils.tile_cache import TileCache
+from utils.instrumentation import span, count
+from utils.wms_fetch import WMSFetcher, LAYER_PARAMS
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+_tile_cache = None
+
+# featurewise statistics of the classification training set
+CLASS_MEAN = np.array(
+    [0.18298785, 0.18298785, 0.18298785], dtype=np.float32
+).reshape((1, 1, 3))  # ordering: [R, G, B]
+CLASS_STD = np.array(
+    [0.2052155, 0.19940454, 0.17583372], dtype=np.float32
+).reshape((1, 1, 3))
+
+
+def draw_map(zoom_start: float = 5.7):
+    import folium
+    from branca.colormap import linear
+    from folium.plugins import Draw
+    from utils.map_layer import region_layer
+
+    m = folium.Map(location=[47.0810, 4.3988], zoom_start=zoom_start)
+
+    # regions simplified for the zoom level, with the data on
+    # food production in France baked in, cached across reruns
+    layer = region_layer(zoom_start)
+    values = [f["properties"]["Food Production"] for f in layer["features"]]
+    colormap = linear.Blues_06.scale(
+        min(v for v in values if v is not None),
+        max(v for v in values if v is not None),
+    ).to_step(6)
+    colormap.caption = "Food Index"
+
+    def style(feature):
+        value = feature["properties"]["Food Production"]
+        return {
+            "fillColor": "black" if value is None else colormap(value),
+            "fillOpacity": 0.6,
+            "color": "black",
+            "weight": 1,
+            "opacity": 1,
+        }
+
+    folium.GeoJson(layer, name="choropleth", style_function=style).add_to(m)
+    colormap.add_to(m)
+
+    # precomputed silo probabilities, served from the tile pyramid
+    if config.tile_pyramid:
+        from utils.tile_pyramid import start_tile_server, tile_url, metadata
+
+        start_tile_server()
+        folium.TileLayer(
+            tiles=tile_url(),
+            attr="Foodix silo scan",
+            name="Silo probability",
+            overlay=True,
+            opacity=0.8,
+            min_zoom=0,
+            max_zoom=19,
+            max_native_zoom=int(metadata(config.tile_pyramid)["maxzoom"]),
+        ).add_to(m)
+        folium.LayerControl().add_to(m)
 
     # allow drawing on map
     Draw(
@@ -52,39 +100,86 @@ def draw_square(coords: list):
     return bbox
 
 
-def download_picture(bbox: str, dir_name: str):
+def get_fetcher():
+    """
+    Process-wide WMS client, shared by all sessions and threads
+    so its keep-alive connections are reused.
+    """
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = WMSFetcher(
+                config.wms_url,
+                max_connections=config.wms_connections,
+                retries=config.wms_retries,
+                timeout=config.wms_timeout,
+            )
+    return _fetcher
+
+
+def get_tile_cache():
+    """
+    Process-wide picture cache, None when config.tile_cache_dir is unset.
+    """
+    global _tile_cache
+    with _fetcher_lock:
+        if _tile_cache is None and config.tile_cache_dir:
+            _tile_cache = TileCache(config.tile_cache_dir, config.tile_cache_bytes)
+    return _tile_cache
+
+
+def fetch_picture(bbox: str, size: int = 4000):
+    """
+    Returns the JPEG bytes of the size x size orthophoto covering bbox,
+    from the tile cache when it was downloaded before.
+    """
+    with span("fetch", bbox=bbox, size=size) as s:
+        cache = get_tile_cache()
+        if cache is None:
+            data = get_fetcher().fetch(bbox, width=size, height=size)
+            s.set(bytes=len(data), cache_hit=False)
+            return data
+
+        key = cache.key(bbox, url=config.wms_url, WIDTH=size, HEIGHT=size, **LAYER_PARAMS)
+        if (data := cache.get(key)) is None:
+            data = get_fetcher().fetch(bbox, width=size, height=size)
+            cache.put(key, data)
+            count("tile_cache_misses")
+            s.set(bytes=len(data), cache_hit=False)
+        else:
+            count("tile_cache_hits")
+            s.set(bytes=len(data), cache_hit=True)
+        return data
+
+
+def download_picture(bbox: str, dir_name: str, size: int = 4000):
     picture_path = dir_name + "pic.jpg"
 
-    url = "https://wxs.ign.fr/ortho/geoportail/r/wms?LAYERS=HR.ORTHOIMAGERY.ORTHOPHOTOS&EXCEPTIONS=text/xml&FORMAT=image/jpeg&SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&STYLES=&CRS=EPSG:4326&WIDTH=4000&HEIGHT=4000&BBOX="
-    url += bbox
-    urllib.request.urlretrieve(url, picture_path)
+    with open(picture_path, "wb") as f:
+        f.write(fetch_picture(bbox, size))
 
     return picture_path
 
 
-def load_image(picture_path):
-    img = Image.open(picture_path)
-    img.load()
-    img = img.resize((256, 256))
-    data = np.asarray(img, dtype="int32")
-    return data
+def preprocess_class(test_image):
+    # same standardisation as keras' ImageDataGenerator(rescale=1./255,
+    # featurewise_center=True, featurewise_std_normalization=True)
+    x = test_image.astype(np.float32)
+    x *= 1.0 / 255
+    x -= CLASS_MEAN
+    x /= CLASS_STD + 1e-6
+    return x
 
 
-def preprocess_class(test_image):
-    x = test_image.copy()
-    test_datagen = ImageDataGenerator(
-        rescale=1./255,
-        featurewise_center=True,
-        featurewise_std_normalization=True)
-
-    test_datagen.mean = np.array(
-        [0.18298785, 0.18298785, 0.18298785],
-        dtype=np.float32
-        ).reshape((1,1,3)) # ordering: [R, G, B]
-
-    test_datagen.std = np.array(
-        [0.2052155,  0.19940454, 0.17583372],
-        dtype=np.float32
-        ).reshape((1,1,3))
-
-    return  test_datagen.standardize(x)
\ No newline at end of file
+def array_to_image(x: np.ndarray):
+    """
+    Converts a float [H, W, C] array to a PIL image, scaling
+    it to [0, 255] like keras' array_to_img. uint8 arrays are
+    taken as they are.
+    """
+    if x.dtype == np.uint8:
+        return Image.fromarray(x)
+    x = x - np.min(x)
+    if (x_max := np.max(x)) != 0:
+        x /= x_max
+    return Image.fromarray((x * 255).astype(np.uint8))
@@ -0,0 +1,173 @@
+"""
+Memo of finished analyses, keyed by content.
+
+Streamlit reruns the whole script on every click, and two users may
+analyse the same picture. An analysis is keyed by the sha256 of the
+picture bytes, the version of the model files (path, mtime and size)
+and the parameters that change its result, so a repeat is a lookup.
+Entries keep the probability, area and category and the mask packed
+to one bit per pixel and zlib compressed: a 256x256 mask takes a few
+hundred bytes. They live in a bounded in-memory LRU shared by all
+sessions, and optionally in config.memo_dir, written atomically like
+the tile cache so several processes can share it.
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+import threading
+import collections
+import numpy as np
+import config
+from utils.instrumentation import count
+
+
+def pack_mask(mask: np.ndarray):
+    return zlib.compress(np.packbits(mask != 0).tobytes())
+
+
+def unpack_mask(blob: bytes, shape: tuple):
+    bits = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape)
+
+
+def _file_version(path: str):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return "%s:missing" % path
+    return "%s:%d:%d" % (path, stat.st_mtime_ns, stat.st_size)
+
+
+def model_version():
+    """
+    Identifies the model files currently configured, changes whenever
+    one of them is replaced.
+    """
+    files = [
+        config.classifier_export or config.keras_model,
+        config.mapping_export or config.mapping_weights,
+    ]
+    return hashlib.sha256("|".join(map(_file_version, files)).encode()).hexdigest()[:16]
+
+
+def source_digest(source):
+    """
+    sha256 of the bytes of a picture given as bytes, a path or a file-like.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    elif hasattr(source, "getbuffer"):
+        digest.update(source.getbuffer())
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionMemo:
+    def __init__(self, max_entries: int = 256, directory: str = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source, **params):
+        """
+        Memo key of the analysis of source with the current models.
+        """
+        layer = "&".join("%s=%s" % (k, params[k]) for k in sorted(params))
+        text = "|".join([source_digest(source), model_version(), layer])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the stored dict with probability, mask (None when the
+        picture was not segmented), area and category, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory:
+            entry = self._read(key)
+            if entry is not None:
+                self._remember(key, entry)
+        count("memo_hits" if entry is not None else "memo_misses")
+        if entry is None:
+            return None
+
+        header, blob = entry
+        result = dict(header)
+        shape = result.pop("shape")
+        result["mask"] = unpack_mask(blob, shape) if shape else None
+        return result
+
+    def put(self, key: str, probability: float, mask=None, area: float = 0.0, category=None):
+        header = {
+            "probability": float(probability),
+            "area": float(area),
+            "category": category,
+            "shape": list(mask.shape) if mask is not None else None,
+        }
+        entry = (header, pack_mask(mask) if mask is not None else b"")
+        self._remember(key, entry)
+        if self.directory:
+            self._write(key, entry)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + ".memo")
+
+    def _read(self, key: str):
+        # a JSON header line followed by the packed mask
+        try:
+            with open(self._path(key), "rb") as f:
+                header = json.loads(f.readline())
+                return header, f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, key: str, entry):
+        header, blob = entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(blob)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def get_memo():
+    """
+    Process-wide memo, None when config.memo_entries is 0.
+    """
+    global _memo
+    with _memo_lock:
+        if _memo is None and config.memo_entries:
+            _memo = PredictionMemo(config.memo_entries, config.memo_dir)
+    return _memo
@@ -0,0 +1,342 @@
+"""
+Windowed reading of rasters too large to decode at once.
+
+A 20k x 20k orthophoto is 1.2 GB of RGB pixels, so large uploads are
+never decoded as a whole: they are read window by window and fed to
+the models, keeping memory proportional to the window size.
+
+    RasterioRaster  any GDAL raster (tiled or BigTIFF GeoTIFF, JPEG read
+                    by strips...), when rasterio is installed
+    MemmapRaster    uncompressed TIFF / BigTIFF, memory-mapped, PIL only
+    PILRaster       anything PIL reads, decoded at once, for images of
+                    at most config.raster_max_pixels
+
+    with open_raster("survey.tif") as raster:
+        for x, y, window in windows(raster, 256):
+            ...
+"""
+
+import io
+import os
+import abc
+import threading
+import contextlib
+import numpy as np
+from PIL import Image
+import config
+from utils.image_ingest import open_image, read_image
+
+_bomb_lock = threading.Lock()
+
+# PIL raw modes MemmapRaster reads, with their number of bytes per pixel
+_RAW_MODES = {"RGB": 3, "RGBX": 4, "RGBA": 4, "L": 1}
+
+
+@contextlib.contextmanager
+def _header_only():
+    # PIL refuses to even open images above its decompression bomb limit,
+    # which does not apply to reading them window by window
+    with _bomb_lock:
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _to_rgb(pixels: np.ndarray):
+    # grey (with or without alpha) to RGB, extra bands dropped
+    if pixels.shape[2] < 3:
+        return np.repeat(pixels[:, :, :1], 3, axis=2)
+    return pixels[:, :, :3]
+
+
+def _bands(count: int):
+    # rasterio band indexes to read: grey for 1-2 bands, else RGB
+    return [1] if count < 3 else [1, 2, 3]
+
+
+def _to_uint8(pixels: np.ndarray):
+    """
+    Rescales pixels to uint8 by the range of their dtype, e.g. 16-bit
+    surveys by 255 / 65535. Floats are taken to be in [0, 1].
+    """
+    if pixels.dtype == np.uint8:
+        return pixels
+    if np.issubdtype(pixels.dtype, np.integer):
+        high = np.iinfo(pixels.dtype).max
+        scaled = np.clip(pixels, 0, None) * (255 / high)
+    else:
+        scaled = np.clip(pixels, 0, 1) * 255
+    return np.round(scaled).astype(np.uint8)
+
+
+class Raster(abc.ABC):
+    width = height = 0
+    # ground area of one pixel in square meters, None when unknown
+    pixel_area = None
+
+    @abc.abstractmethod
+    def read(self, x: int, y: int, width: int, height: int):
+        """
+        [height, width, 3] uint8 pixels of the window at (x, y).
+        """
+
+    def thumbnail(self, size: int):
+        """
+        Nearest-neighbour PIL preview of at most size x size pixels,
+        read one row at a time.
+        """
+        step = max(1, -(-max(self.width, self.height) // size))
+        rows = [self.read(0, y, self.width, 1)[0, ::step] for y in range(0, self.height, step)]
+        return Image.fromarray(np.stack(rows))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class RasterioRaster(Raster):
+    def __init__(self, source):
+        import rasterio
+
+        if hasattr(source, "read"):
+            source.seek(0)
+            self._memfile = rasterio.io.MemoryFile(source.read())
+            self.dataset = self._memfile.open()
+        else:
+            self._memfile = None
+            self.dataset = rasterio.open(source)
+        self.width, self.height = self.dataset.width, self.dataset.height
+        self.pixel_area = self._pixel_area()
+
+    def _pixel_area(self):
+        crs, transform = self.dataset.crs, self.dataset.transform
+        if crs is None or transform.is_identity:
+            return None
+        width, height = abs(transform.a), abs(transform.e)
+        if crs.is_projected:
+            return width * height * crs.linear_units_factor[1] ** 2
+        if crs.is_geographic:
+            # degrees to meters at the latitude of the raster centre
+            lat = transform.f + transform.e * self.height / 2
+            return width * 111320 * np.cos(np.radians(lat)) * height * 110540
+        return None
+
+    def read(self, x, y, width, height):
+        from rasterio.windows import Window
+
+        pixels = self.dataset.read(
+            _bands(self.dataset.count), window=Window(x, y, width, height)
+        )
+        return _to_rgb(_to_uint8(np.moveaxis(pixels, 0, -1)))
+
+    def thumbnail(self, size):
+        from rasterio.enums import Resampling
+
+        scale = size / max(self.width, self.height)
+        shape = (max(1, int(self.height * scale)), max(1, int(self.width * scale)))
+        bands = _bands(self.dataset.count)
+        pixels = self.dataset.read(
+            bands, out_shape=(len(bands), *shape), resampling=Resampling.average
+        )
+        return Image.fromarray(_to_rgb(_to_uint8(np.moveaxis(pixels, 0, -1))))
+
+    def close(self):
+        self.dataset.close()
+        if self._memfile is not None:
+            self._memfile.close()
+
+
+class MemmapRaster(Raster):
+    """
+    Uncompressed TIFF whose strips or tiles are mapped, not read: only
+    the pages a window touches are ever loaded. File-like sources are
+    viewed through their buffer without copying.
+    """
+
+    def __init__(self, source, image: Image.Image):
+        self.width, self.height = image.size
+        if isinstance(source, (str, os.PathLike)):
+            self._buffer = np.memmap(source, dtype=np.uint8, mode="r")
+        elif isinstance(source, io.BytesIO):
+            self._buffer = np.frombuffer(source.getbuffer(), dtype=np.uint8)
+        else:
+            self._buffer = np.frombuffer(source, dtype=np.uint8)
+
+        self._tiles = []
+        for tile in image.tile:
+            rawmode, stride = tile.args[0], tile.args[1]
+            x0, y0, x1, y1 = tile.extents
+            depth = _RAW_MODES[rawmode]
+            stride = stride or (x1 - x0) * depth
+            rows = min(y1, self.height) - y0
+            data = self._buffer[tile.offset : tile.offset + rows * stride]
+            pixels = data.reshape(rows, stride)[:, : (x1 - x0) * depth]
+            self._tiles.append(((x0, y0), pixels.reshape(rows, x1 - x0, depth)))
+        self._boxes = np.array(
+            [(x0, y0, x0 + p.shape[1], y0 + p.shape[0]) for (x0, y0), p in self._tiles]
+        )
+
+    @staticmethod
+    def supports(image: Image.Image):
+        return image.format == "TIFF" and all(
+            tile.codec_name == "raw"
+            and tile.args[0] in _RAW_MODES
+            and (len(tile.args) < 3 or tile.args[2] == 1)  # top-down rows
+            for tile in image.tile
+        )
+
+    def read(self, x, y, width, height):
+        out = np.zeros((height, width, 3), dtype=np.uint8)
+        boxes = self._boxes
+        hits = np.flatnonzero(
+            (boxes[:, 0] < x + width)
+            & (boxes[:, 2] > x)
+            & (boxes[:, 1] < y + height)
+            & (boxes[:, 3] > y)
+        )
+        for i in hits:
+            (x0, y0), pixels = self._tiles[i]
+            left, top = max(x, x0), max(y, y0)
+            # edge tiles are padded beyond the image
+            right = min(x + width, x0 + pixels.shape[1], self.width)
+            bottom = min(y + height, y0 + pixels.shape[0], self.height)
+            out[top - y : bottom - y, left - x : right - x] = _to_rgb(
+                pixels[top - y0 : bottom - y0, left - x0 : right - x0]
+            )
+        return out
+
+
+class PILRaster(Raster):
+    def __init__(self, source):
+        self.pixels = np.asarray(read_image(source))
+        self.height, self.width = self.pixels.shape[:2]
+
+    def read(self, x, y, width, height):
+        out = np.zeros((height, width, 3), dtype=np.uint8)
+        window = self.pixels[y : y + height, x : x + width]
+        out[: window.shape[0], : window.shape[1]] = window
+        return out
+
+
+def open_raster(source, max_pixels: int = None):
+    """
+    Opens a path, bytes or file-like raster with the best windowed
+    reader available. Raises ValueError for an image larger than
+    max_pixels (config.raster_max_pixels) that only PIL can read.
+    """
+    max_pixels = max_pixels or config.raster_max_pixels
+    with _header_only():
+        image = open_image(source)
+    with image:
+        if MemmapRaster.supports(image):
+            return MemmapRaster(source, image)
+        width, height = image.size
+    try:
+        return RasterioRaster(source)
+    except ImportError:
+        pass
+    if width * height > max_pixels:
+        raise ValueError(
+            "%dx%d image needs rasterio to be read by windows (pipenv install "
+            "--categories rasters), or an uncompressed TIFF" % (width, height)
+        )
+    return PILRaster(source)
+
+
+def is_large(source, max_pixels: int = None):
+    """
+    Whether source has more than max_pixels (config.raster_max_pixels),
+    reading its header only.
+    """
+    max_pixels = max_pixels or config.raster_max_pixels
+    with _header_only(), open_image(source) as image:
+        width, height = image.size
+    return width * height > max_pixels
+
+
+def windows(raster: Raster, size: int = 256, overlap: int = 0):
+    """
+    Yields (x, y, [size, size, 3] uint8 window) covering the raster row
+    by row. The last window of a row or column is flush with the border,
+    rasters smaller than size are zero padded.
+    """
+    from utils.map_utils import _tile_starts
+
+    stride = size - overlap
+    for y in _tile_starts(raster.height, size, stride):
+        for x in _tile_starts(raster.width, size, stride):
+            yield x, y, raster.read(x, y, size, size)
+
+
+def _owned(length: int, size: int):
+    # start of every window along one axis -> the (begin, end) part of
+    # it, in window coordinates, that no other window counts. windows
+    # that overlap split the overlap in the middle
+    from utils.map_utils import _tile_starts
+
+    starts = _tile_starts(length, size, size)
+    bounds = [0]
+    for previous, start in zip(starts, starts[1:]):
+        bounds.append((start + previous + size) // 2)
+    bounds.append(min(length, starts[-1] + size))
+    return {
+        start: (begin - start, end - start)
+        for start, begin, end in zip(starts, bounds, bounds[1:])
+    }
+
+
+def _own(result: dict, rows: tuple, cols: tuple, pixel_area: float):
+    # restricts area and silos of a window result to the part it owns
+    from utils.map_utils import _group
+
+    if result["mask"] is None:
+        return result
+    owned = result["mask"][rows[0] : rows[1], cols[0] : cols[1]]
+    result["area"] = float(np.count_nonzero(owned) * pixel_area)
+    result["category"] = _group(result["area"])
+    silos = []
+    for silo in result["silos"]:
+        row, col = silo["centroid"]
+        if rows[0] <= row < rows[1] and cols[0] <= col < cols[1]:
+            silo["area"] = float(silo["pixels"] * pixel_area)
+            silo["category"] = _group(silo["area"])
+            silos.append(silo)
+    result["silos"] = silos
+    return result
+
+
+def scan_raster(raster: Raster, cascade, size: int = 256, batch_size: int = 16):
+    """
+    Runs the windows of raster through an analysis.Cascade, batch_size
+    windows at a time, and yields (x, y, result) for every window.
+
+    The last window of a row or column overlaps its neighbour, so the
+    area and silos of a result only cover the part of the raster the
+    window owns (silos by their centroid) and can be summed over the
+    windows. Areas use raster.pixel_area, or assume a window covers
+    128 x 128 meters when it is unknown.
+    """
+    pixel_area = raster.pixel_area or (128 / size) ** 2
+    rows, cols = _owned(raster.height, size), _owned(raster.width, size)
+
+    def run(batch):
+        results = cascade.run([window for *_, window in batch])
+        for (x, y, _), result in zip(batch, results):
+            yield x, y, _own(result, rows[y], cols[x], pixel_area)
+
+    batch = []
+    for item in windows(raster, size):
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from run(batch)
+            batch = []
+    if batch:
+        yield from run(batch)
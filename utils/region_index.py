@@ -0,0 +1,221 @@
+"""
+Spatial index of the regions of data/regions.geojson.
+
+Region boundaries are cut into horizontal bands once per process, each
+band keeping only the polygon edges that cross it. Locating a point is
+then an even-odd ray cast against the few edges of its band, done for
+all the points of a band at once, so millions of detections are
+assigned in seconds.
+
+Silo detections written by region_scan --detections are assigned to
+regions and aggregated: silo count, covered area and size category mix,
+next to the famine and food production figures of data/regions_data.csv.
+
+    python -m utils.region_index detections.csv regions_silos.csv
+"""
+
+import csv
+import json
+import argparse
+import functools
+import numpy as np
+from utils.map_layer import GEOJSON_PATH, DATA_PATH
+
+CATEGORIES = ["small", "medium", "big", "huge"]
+
+
+def georeference(bbox: str, centroid: tuple, shape: tuple):
+    """
+    (lon, lat) of a pixel position (row, col) of a picture of shape
+    [H, W] fetched for bbox "lat_min,lon_min,lat_max,lon_max".
+    Row 0 is the north edge of the picture.
+    """
+    lat_min, lon_min, lat_max, lon_max = (float(x) for x in bbox.split(","))
+    row, col = centroid
+    lon = lon_min + (col + 0.5) / shape[1] * (lon_max - lon_min)
+    lat = lat_max - (row + 0.5) / shape[0] * (lat_max - lat_min)
+    return lon, lat
+
+
+class RegionIndex:
+    """
+    Band index over region polygons, see locate.
+    """
+
+    def __init__(self, geojson_path: str = GEOJSON_PATH, band_height: float = 0.01):
+        with open(geojson_path, encoding="utf-8") as f:
+            features = json.load(f)["features"]
+
+        self.names = []
+        edges, owners = [], []
+        for i, feature in enumerate(features):
+            self.names.append(feature["properties"]["Region"])
+            geometry = feature["geometry"]
+            polygons = geometry["coordinates"]
+            if geometry["type"] == "Polygon":
+                polygons = [polygons]
+            for polygon in polygons:
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype=np.float64)
+                    edges.append(np.hstack([ring[:-1], ring[1:]]))
+                    owners.append(np.full(len(ring) - 1, i))
+        edges = np.concatenate(edges)  # [E, 4] as lon0, lat0, lon1, lat1
+        owners = np.concatenate(owners)
+
+        # horizontal edges never cross a horizontal ray
+        keep = edges[:, 1] != edges[:, 3]
+        edges, owners = edges[keep], owners[keep]
+
+        self.lat0 = edges[:, [1, 3]].min()
+        self.band_height = band_height
+        self.n_bands = int((edges[:, [1, 3]].max() - self.lat0) // band_height) + 1
+
+        # every edge goes to all the bands its latitude range overlaps
+        first = self._band(edges[:, [1, 3]].min(axis=1))
+        last = self._band(edges[:, [1, 3]].max(axis=1))
+        n = last - first + 1
+        edge_ids = np.repeat(np.arange(len(edges)), n)
+        bands = np.repeat(first, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        order = np.argsort(bands, kind="stable")
+        self._edges = edges[edge_ids[order]]
+        self._owners = owners[edge_ids[order]]
+        self._offsets = np.searchsorted(bands[order], np.arange(self.n_bands + 1))
+
+    def _band(self, lats: np.ndarray):
+        return ((lats - self.lat0) // self.band_height).astype(np.int64)
+
+    def locate(self, lons, lats, chunk: int = 4_000_000):
+        """
+        Index in self.names of the region containing each point, -1 outside
+        all regions. chunk bounds the points x edges work done at once.
+        """
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        regions = np.full(len(lons), -1, dtype=np.int64)
+
+        bands = self._band(lats)
+        inside = np.flatnonzero((bands >= 0) & (bands < self.n_bands))
+        order = inside[np.argsort(bands[inside], kind="stable")]
+        starts = np.searchsorted(bands[order], np.arange(self.n_bands + 1))
+
+        for band in np.flatnonzero(np.diff(starts)):
+            lo, hi = self._offsets[band], self._offsets[band + 1]
+            if lo == hi:
+                continue
+            edges, owners = self._edges[lo:hi], self._owners[lo:hi]
+            step = max(1, chunk // (hi - lo))
+            for i in range(starts[band], starts[band + 1], step):
+                points = order[i : min(i + step, starts[band + 1])]
+                regions[points] = self._cast(lons[points], lats[points], edges, owners)
+        return regions
+
+    def _cast(self, lons, lats, edges, owners):
+        # even-odd rule per region: count the edges crossed by a ray
+        # going east from each point
+        x0, y0, x1, y1 = (edges[:, i] for i in range(4))
+        lons, lats = lons[:, np.newaxis], lats[:, np.newaxis]
+        spans = (y0 > lats) != (y1 > lats)
+        crossing_lon = x0 + (lats - y0) * (x1 - x0) / (y1 - y0)
+        crossed = spans & (lons < crossing_lon)
+
+        # crossings per region as a product with the one-hot edge owners
+        onehot = np.eye(len(self.names), dtype=np.float32)[owners]
+        parity = (crossed.astype(np.float32) @ onehot).astype(np.int64) % 2
+        return np.where(parity.any(axis=1), parity.argmax(axis=1), -1)
+
+
+@functools.lru_cache(maxsize=4)
+def load_index(geojson_path: str = GEOJSON_PATH):
+    """
+    RegionIndex of geojson_path, built once per process.
+    """
+    return RegionIndex(geojson_path)
+
+
+def _region_data(data_path: str):
+    with open(data_path, encoding="utf-8") as f:
+        return {row["Regions"]: row for row in csv.DictReader(f)}
+
+
+def aggregate(
+    lons,
+    lats,
+    areas,
+    categories,
+    index: RegionIndex = None,
+    data_path: str = DATA_PATH,
+):
+    """
+    Assigns detections to regions and returns one dict per region with
+    its silo count, total area in square meters, count per size category,
+    famine percentage and food production index.
+    """
+    index = index or load_index()
+    regions = index.locate(lons, lats)
+    found = regions >= 0
+    regions = regions[found]
+    areas = np.asarray(areas, dtype=np.float64)[found]
+    categories = np.asarray(categories)[found]
+
+    n = len(index.names)
+    counts = np.bincount(regions, minlength=n)
+    total_areas = np.bincount(regions, weights=areas, minlength=n)
+    per_category = {
+        category: np.bincount(regions[categories == category], minlength=n)
+        for category in CATEGORIES
+    }
+
+    data = _region_data(data_path)
+    rows = []
+    for i, name in enumerate(index.names):
+        row = data.get(name, {})
+        rows.append(
+            {
+                "region": name,
+                "silos": int(counts[i]),
+                "area": float(total_areas[i]),
+                **{c: int(per_category[c][i]) for c in CATEGORIES},
+                "famine": float(row["Famine %"]) if row else None,
+                "food_production": float(row["Food Production"]) if row else None,
+            }
+        )
+    return rows
+
+
+def load_detections(path: str):
+    """
+    lon, lat, area and category columns of a detections .csv or .parquet file.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=["lon", "lat", "area", "category"])
+        columns = table.to_pydict()
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        columns = {key: [row[key] for row in rows] for key in ("lon", "lat", "area", "category")}
+    return (
+        np.asarray(columns["lon"], dtype=np.float64),
+        np.asarray(columns["lat"], dtype=np.float64),
+        np.asarray(columns["area"], dtype=np.float64),
+        np.asarray(columns["category"]),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("detections", help=".csv or .parquet from region_scan --detections")
+    parser.add_argument("out", help="output .csv file, one row per region")
+    args = parser.parse_args()
+
+    rows = aggregate(*load_detections(args.detections))
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print("%d silos in %d regions" % (sum(r["silos"] for r in rows), len(rows)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Headless silo scan over a whole region of data/regions.geojson.
+
+The region polygon is tiled into draw_square sized boxes which are
+streamed through fetch -> classify/segment -> write. Stages are
+connected by bounded queues so memory stays flat whatever the number
+of tiles, and results are appended to the output file batch by batch.
+Only tiles the classifier accepts are segmented, see analysis.Cascade.
+With --detections, every silo found is also written with the lon/lat of
+its centroid, ready for utils/region_index.py.
+
+    python -m utils.region_scan "Hauts-de-France" silos.csv
+    python -m utils.region_scan "Bretagne" silos.csv --threshold 0.3
+    python -m utils.region_scan "Bretagne" silos.csv --detections found.csv
+"""
+
+import csv
+import json
+import queue
+import argparse
+import threading
+import numpy as np
+from utils.image_ingest import decode
+from utils.picture_fetch import draw_square, fetch_picture
+from utils.region_index import georeference
+
+# draw_square spans 2 * 0.0008 degrees in both directions
+TILE_STEP = 0.0016
+
+FIELDS = [
+    "region",
+    "lon",
+    "lat",
+    "bbox",
+    "probability",
+    "area",
+    "category",
+    "silos",
+]
+
+DETECTION_FIELDS = ["region", "lon", "lat", "bbox", "pixels", "area", "category"]
+
+_DONE = object()
+
+
+def load_region(region: str, geojson_path: str = "data/regions.geojson"):
+    """
+    Returns the rings of a region polygon as a list of [N, 2] (lon, lat) arrays.
+    """
+    with open(geojson_path, encoding="utf-8") as f:
+        features = json.load(f)["features"]
+
+    for feature in features:
+        if feature["properties"]["Region"] == region:
+            geometry = feature["geometry"]
+            polygons = geometry["coordinates"]
+            if geometry["type"] == "Polygon":
+                polygons = [polygons]
+            return [np.asarray(ring) for polygon in polygons for ring in polygon]
+
+    names = [feature["properties"]["Region"] for feature in features]
+    raise ValueError("unknown region %r, expected one of %s" % (region, names))
+
+
+def _row_inside(rings, lons: np.ndarray, lat: float):
+    # even-odd rule along one grid row: count ring crossings right of each point
+    crossings = []
+    for ring in rings:
+        x0, y0 = ring[:-1, 0], ring[:-1, 1]
+        x1, y1 = ring[1:, 0], ring[1:, 1]
+        hit = (y0 > lat) != (y1 > lat)
+        crossings.append(
+            x0[hit] + (lat - y0[hit]) * (x1[hit] - x0[hit]) / (y1[hit] - y0[hit])
+        )
+    crossings = np.sort(np.concatenate(crossings))
+    right = len(crossings) - np.searchsorted(crossings, lons, side="right")
+    return right % 2 == 1
+
+
+def region_tiles(rings, step: float = TILE_STEP):
+    """
+    Lazily yields (lon, lat) centres of the grid tiles inside the region.
+    """
+    bounds = np.concatenate(rings)
+    lon_min, lat_min = bounds.min(axis=0)
+    lon_max, lat_max = bounds.max(axis=0)
+
+    lons = np.arange(lon_min + step / 2, lon_max, step)
+    for lat in np.arange(lat_min + step / 2, lat_max, step):
+        for lon in lons[_row_inside(rings, lons, lat)]:
+            yield float(lon), float(lat)
+
+
+def _threaded(iterable, maxsize: int = 16):
+    """
+    Runs a generator in a background thread, handing its items over
+    through a bounded queue.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            items.put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (item := items.get()) is not _DONE:
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def fetch_tiles(tiles, workers: int = 4, maxsize: int = 16, size: int = 256):
+    """
+    Downloads the picture of every (lon, lat) tile with a pool of
+    workers, yields (lon, lat, bbox, image) with size x size images.
+    Tiles that fail to download are reported and skipped.
+    """
+    todo = queue.Queue(maxsize=maxsize)
+    done = queue.Queue(maxsize=maxsize)
+
+    def feed():
+        for tile in tiles:
+            todo.put(tile)
+        for _ in range(workers):
+            todo.put(_DONE)
+
+    def fetch():
+        # each worker reuses its own keep-alive connection to the WMS
+        while (tile := todo.get()) is not _DONE:
+            bbox = draw_square(tile)
+            try:
+                image = decode(fetch_picture(bbox, size), size)
+            except Exception as e:
+                print("skipping tile %s: %s" % (bbox, e))
+                continue
+            done.put((*tile, bbox, image))
+        done.put(_DONE)
+
+    threading.Thread(target=feed, daemon=True).start()
+    for _ in range(workers):
+        threading.Thread(target=fetch, daemon=True).start()
+
+    running = workers
+    while running:
+        item = done.get()
+        if item is _DONE:
+            running -= 1
+        else:
+            yield item
+
+
+def _drain(q: queue.Queue):
+    while (item := q.get()) is not _DONE:
+        yield item
+
+
+def _detections(bbox: str, result: dict):
+    detections = []
+    for silo in result["silos"]:
+        lon, lat = georeference(bbox, silo["centroid"], result["mask"].shape)
+        detections.append(
+            {
+                "lon": lon,
+                "lat": lat,
+                "bbox": bbox,
+                "pixels": silo["pixels"],
+                "area": silo["area"],
+                "category": silo["category"],
+            }
+        )
+    return detections
+
+
+def analyse_tiles(fetched, cascade, batch_size: int = 16):
+    """
+    Groups fetched tiles in batches, runs them through an
+    analysis.Cascade and yields one result row per tile, with the
+    georeferenced silos of the tile under "detections".
+    """
+
+    def flush(batch):
+        results = cascade.run([image for *_, image in batch])
+        for (lon, lat, bbox, _), result in zip(batch, results):
+            yield {
+                "lon": lon,
+                "lat": lat,
+                "bbox": bbox,
+                "probability": result["probability"],
+                "area": result["area"],
+                "category": result["category"],
+                "silos": len(result["silos"]),
+                "detections": _detections(bbox, result),
+            }
+
+    batch = []
+    for item in fetched:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from flush(batch)
+            batch = []
+    yield from flush(batch)
+
+
+def _write_parquet(rows, out_path: str, flush_every: int):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    count = 0
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) < flush_every:
+                continue
+            table = pa.Table.from_pylist(chunk)
+            writer = writer or pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+            chunk = []
+        if chunk:
+            table = pa.Table.from_pylist(chunk)
+            writer = writer or pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def write_rows(rows, out_path: str, flush_every: int = 64, fields=FIELDS):
+    """
+    Appends result rows to a .csv or .parquet file every flush_every rows.
+    Returns the number of rows written.
+    """
+    if out_path.endswith(".parquet"):
+        return _write_parquet(rows, out_path, flush_every)
+
+    count = 0
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % flush_every == 0:
+                f.flush()
+    return count
+
+
+def scan_region(
+    region: str,
+    out_path: str,
+    class_model,
+    mapping_model,
+    device=None,
+    workers: int = 4,
+    batch_size: int = 16,
+    limit: int = None,
+    threshold: float = None,
+    detections_path: str = None,
+):
+    """
+    Scans region into out_path, and its silos into detections_path if
+    given. Returns the number of rows written and the cascade counters.
+    """
+    from utils.analysis import Cascade
+
+    rings = load_region(region)
+    tiles = region_tiles(rings)
+    if limit is not None:
+        tiles = (tile for _, tile in zip(range(limit), tiles))
+
+    fetched = fetch_tiles(tiles, workers=workers, maxsize=2 * batch_size)
+    cascade = Cascade(class_model, mapping_model, threshold, device, batch_size)
+    results = analyse_tiles(fetched, cascade, batch_size)
+
+    # detections are written by their own thread as tile rows go by
+    detections = queue.Queue(maxsize=4 * batch_size)
+    detection_writer = None
+    writer_errors = []
+
+    def write_detections():
+        try:
+            write_rows(_drain(detections), detections_path, 64, DETECTION_FIELDS)
+        except BaseException as e:
+            writer_errors.append(e)
+
+    def put(item):
+        # a dead writer no longer drains the queue, fail instead of blocking
+        while True:
+            if writer_errors:
+                raise writer_errors[0]
+            try:
+                detections.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    if detections_path:
+        detection_writer = threading.Thread(target=write_detections, daemon=True)
+        detection_writer.start()
+
+    def rows():
+        try:
+            for row in results:
+                found = row.pop("detections")
+                if detection_writer is not None:
+                    for detection in found:
+                        put({"region": region, **detection})
+                yield {"region": region, **row}
+        finally:
+            if detection_writer is not None and not writer_errors:
+                put(_DONE)
+
+    count = write_rows(_threaded(rows(), maxsize=2 * batch_size), out_path)
+    if detection_writer is not None:
+        detection_writer.join()
+    if writer_errors:
+        raise writer_errors[0]
+    return count, cascade.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("region", help="region name as in data/regions.geojson")
+    parser.add_argument("out", help="output .csv or .parquet file")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=None, help="scan at most N tiles")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="segment tiles above this silo probability (config.cascade_threshold)",
+    )
+    parser.add_argument(
+        "--detections", default=None, help="also write every silo to this .csv or .parquet"
+    )
+    parser.add_argument(
+        "--class-model", default=None, help="classifier file (config.keras_model)"
+    )
+    parser.add_argument(
+        "--mapping-weights", default=None, help="UNet weights (config.mapping_weights)"
+    )
+    args = parser.parse_args()
+
+    from utils.model_registry import get_classifier, get_mapping_model, use_model_files
+
+    use_model_files(args.class_model, args.mapping_weights)
+
+    count, stats = scan_region(
+        args.region,
+        args.out,
+        get_classifier(),
+        get_mapping_model(),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        limit=args.limit,
+        threshold=args.threshold,
+        detections_path=args.detections,
+    )
+    print("wrote %d tiles to %s" % (count, args.out))
+    print("segmented %(segmented)d, pruned %(pruned)d by the classifier" % stats)
+
+
+if __name__ == "__main__":
+    main()
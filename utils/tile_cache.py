@@ -0,0 +1,101 @@
+"""
+On-disk cache of downloaded orthophotos.
+
+Entries are keyed by the normalised bbox and the layer parameters,
+written atomically (temporary file + rename) so several Streamlit
+sessions can share the directory, and evicted least recently used
+first once the directory grows over max_bytes.
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+# temporary files older than this were left by a crashed writer
+STALE_SECONDS = 3600
+
+
+class TileCache:
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(bbox: str, **params):
+        """
+        Cache key of a picture, "48.1,2.3,..." and "48.10,2.30,..." are
+        the same bbox.
+        """
+        coords = ",".join("%.6f" % float(c) for c in bbox.split(","))
+        layer = "&".join("%s=%s" % (k, params[k]) for k in sorted(params))
+        return hashlib.sha256((coords + "|" + layer).encode()).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + ".jpg")
+
+    def get(self, key: str):
+        """
+        Returns the cached bytes or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another session since, the data is still good
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        stale = time.time() - STALE_SECONDS
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith((".jpg", ".tmp")):
+                continue
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    if stat.st_mtime < stale:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue  # evicted or renamed by another session
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
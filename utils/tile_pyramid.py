@@ -0,0 +1,339 @@
+"""
+Precomputed silo probability map.
+
+An offline job turns region_scan results into a pyramid of web map
+tiles stored in an MBTiles file (SQLite): every scanned cell is drawn
+with its silo probability, from transparent yellow to red, and the
+per-cell summaries (probability, silo area, count and category) are
+kept in a "cells" table next to the tiles. Zoomed out, a pixel shows
+the highest probability of the cells under it.
+
+A small tile server then serves the file, and draw_map shows it as an
+overlay when config.tile_pyramid is set, so browsing known results is
+a tile lookup instead of live inference.
+
+    python -m utils.tile_pyramid build silos.csv silos.mbtiles
+    python -m utils.tile_pyramid build --region Bretagne bretagne.mbtiles
+    python -m utils.tile_pyramid serve silos.mbtiles --port 8502
+"""
+
+import io
+import os
+import csv
+import math
+import sqlite3
+import argparse
+import tempfile
+import threading
+import functools
+import numpy as np
+from PIL import Image
+import config
+
+TILE_SIZE = 256
+CELL_FIELDS = ["lon", "lat", "probability", "area", "silos", "category"]
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def _lut():
+    # uint8 probability code (0 = not scanned) to RGBA, yellow to red
+    p = np.linspace(0, 1, 255)
+    colors = np.zeros((256, 4), dtype=np.uint8)
+    colors[1:, 0] = 255
+    colors[1:, 1] = np.round(255 * (1 - p))
+    colors[1:, 3] = np.round(40 + 200 * p)
+    return colors
+
+
+LUT = _lut()
+
+
+def load_scan(path: str):
+    """
+    Cell columns of a region_scan .csv or .parquet result file.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        columns = pq.read_table(path, columns=CELL_FIELDS).to_pydict()
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        columns = {key: [row[key] for row in rows] for key in CELL_FIELDS}
+    cells = {key: np.asarray(columns[key], dtype=np.float64) for key in CELL_FIELDS[:4]}
+    cells["silos"] = np.asarray(columns["silos"], dtype=np.int64)
+    cells["category"] = list(columns["category"])
+    return cells
+
+
+class _Grid:
+    """
+    Probabilities of the scanned cells as uint8 codes on their regular
+    lon/lat grid, with max-pooled levels for coarse zooms.
+    """
+
+    def __init__(self, lons, lats, probabilities, step: float):
+        self.step = step
+        self.lon0 = lons.min() - step / 2
+        self.lat0 = lats.min() - step / 2
+        cols = np.round((lons - self.lon0) / step - 0.5).astype(np.int64)
+        rows = np.round((lats - self.lat0) / step - 0.5).astype(np.int64)
+
+        codes = np.zeros((rows.max() + 1, cols.max() + 1), dtype=np.uint8)
+        values = 1 + np.round(np.clip(probabilities, 0, 1) * 254).astype(np.uint8)
+        np.maximum.at(codes, (rows, cols), values)
+        self.levels = [codes]
+
+    def level(self, k: int):
+        while len(self.levels) <= k:
+            codes = self.levels[-1]
+            h, w = -(-codes.shape[0] // 2) * 2, -(-codes.shape[1] // 2) * 2
+            padded = np.zeros((h, w), dtype=np.uint8)
+            padded[: codes.shape[0], : codes.shape[1]] = codes
+            self.levels.append(padded.reshape(h // 2, 2, w // 2, 2).max(axis=(1, 3)))
+        return self.levels[k]
+
+    def bounds(self):
+        rows, cols = self.levels[0].shape
+        return (
+            self.lon0,
+            self.lat0,
+            self.lon0 + cols * self.step,
+            self.lat0 + rows * self.step,
+        )
+
+    def sample(self, lons: np.ndarray, lats: np.ndarray, k: int):
+        # nearest cell of level k for a [len(lats), len(lons)] pixel grid
+        codes = self.level(k)
+        size = self.step * 2**k
+        cols = np.floor((lons - self.lon0) / size).astype(np.int64)
+        rows = np.floor((lats - self.lat0) / size).astype(np.int64)
+        col_ok = (cols >= 0) & (cols < codes.shape[1])
+        row_ok = (rows >= 0) & (rows < codes.shape[0])
+        rows = np.clip(rows, 0, codes.shape[0] - 1)
+        cols = np.clip(cols, 0, codes.shape[1] - 1)
+        out = codes[rows[:, None], cols]
+        out[~row_ok] = 0
+        out[:, ~col_ok] = 0
+        return out
+
+
+def _tile_x(lon, zoom):
+    return (lon + 180) / 360 * 2**zoom
+
+
+def _tile_y(lat, zoom):
+    phi = math.radians(lat)
+    return (1 - math.log(math.tan(phi) + 1 / math.cos(phi)) / math.pi) / 2 * 2**zoom
+
+
+def _pixel_lons(x: int, zoom: int):
+    pixels = (x * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / (TILE_SIZE * 2**zoom)
+    return pixels * 360 - 180
+
+
+def _pixel_lats(y: int, zoom: int):
+    pixels = (y * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / (TILE_SIZE * 2**zoom)
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixels))))
+
+
+def render_tiles(grid: _Grid, zoom: int):
+    """
+    Yields (x, y, PNG bytes) for the non empty tiles of grid at zoom.
+    """
+    lon_min, lat_min, lon_max, lat_max = grid.bounds()
+    # finest pooling level whose cells span a pixel, so none is skipped
+    pixel = 360 / (TILE_SIZE * 2**zoom)
+    k = max(0, math.ceil(math.log2(pixel / grid.step)))
+
+    for y in range(int(_tile_y(lat_max, zoom)), int(_tile_y(lat_min, zoom)) + 1):
+        lats = _pixel_lats(y, zoom)
+        for x in range(int(_tile_x(lon_min, zoom)), int(_tile_x(lon_max, zoom)) + 1):
+            codes = grid.sample(_pixel_lons(x, zoom), lats, k)
+            if not codes.any():
+                continue
+            buffer = io.BytesIO()
+            Image.fromarray(LUT[codes], "RGBA").save(buffer, format="PNG", optimize=False)
+            yield x, y, buffer.getvalue()
+
+
+def build(
+    cells: dict, out_path: str, min_zoom: int = 6, max_zoom: int = 14, step: float = None
+):
+    """
+    Writes the MBTiles pyramid of scanned cells (see load_scan) to out_path.
+    Returns the number of tiles written.
+    """
+    from utils.region_scan import TILE_STEP
+
+    grid = _Grid(cells["lon"], cells["lat"], cells["probability"], step or TILE_STEP)
+    lon_min, lat_min, lon_max, lat_max = grid.bounds()
+
+    db = sqlite3.connect(out_path)
+    try:
+        db.executescript(
+            """
+            DROP TABLE IF EXISTS metadata;
+            DROP TABLE IF EXISTS tiles;
+            DROP TABLE IF EXISTS cells;
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                                tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+            CREATE TABLE cells (lon REAL, lat REAL, probability REAL,
+                                area REAL, silos INTEGER, category TEXT);
+            """
+        )
+        db.executemany(
+            "INSERT INTO metadata VALUES (?, ?)",
+            [
+                ("name", "Foodix silo probability"),
+                ("type", "overlay"),
+                ("format", "png"),
+                ("minzoom", str(min_zoom)),
+                ("maxzoom", str(max_zoom)),
+                ("bounds", "%f,%f,%f,%f" % (lon_min, lat_min, lon_max, lat_max)),
+            ],
+        )
+        columns = [list(cells[key]) for key in CELL_FIELDS]
+        columns[4] = [int(n) for n in columns[4]]
+        db.executemany("INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?)", zip(*columns))
+
+        count = 0
+        for zoom in range(min_zoom, max_zoom + 1):
+            # MBTiles rows count from the south (TMS)
+            rows = (
+                (zoom, x, 2**zoom - 1 - y, sqlite3.Binary(data))
+                for x, y, data in render_tiles(grid, zoom)
+            )
+            before = db.total_changes
+            db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+            count += db.total_changes - before
+        db.commit()
+    finally:
+        db.close()
+    return count
+
+
+@functools.lru_cache(maxsize=4)
+def metadata(path: str):
+    db = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+    try:
+        return dict(db.execute("SELECT name, value FROM metadata"))
+    finally:
+        db.close()
+
+
+def start_tile_server(path: str = None, port: int = None, host: str = None):
+    """
+    Serves the tiles of the MBTiles file at path (config.tile_pyramid)
+    on http://host:port/{z}/{x}/{y}.png (config.tile_server_host and
+    tile_server_port) from a daemon thread, once per process.
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    path = path or config.tile_pyramid
+    port = port or config.tile_server_port
+    host = host or config.tile_server_host
+    local = threading.local()
+
+    with _server_lock:
+        if _server is not None or not path:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    z, x, y = self.path.split("?")[0].strip("/").rsplit(".", 1)[0].split("/")
+                    z, x, y = int(z), int(x), int(y)
+                except ValueError:
+                    self.send_error(404)
+                    return
+                if not hasattr(local, "db"):
+                    local.db = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+                row = local.db.execute(
+                    "SELECT tile_data FROM tiles WHERE zoom_level = ? "
+                    "AND tile_column = ? AND tile_row = ?",
+                    (z, x, 2**z - 1 - y),
+                ).fetchone()
+                if row is None:
+                    self.send_response(204)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(row[0])))
+                self.send_header("Cache-Control", "max-age=3600")
+                self.end_headers()
+                self.wfile.write(row[0])
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def tile_url():
+    """
+    URL template of the tiles as seen from the browser.
+    """
+    if config.tile_server_url:
+        return config.tile_server_url
+    return "http://localhost:%d/{z}/{x}/{y}.png" % config.tile_server_port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="build the tile pyramid")
+    build_parser.add_argument("scan", nargs="?", help="region_scan .csv or .parquet")
+    build_parser.add_argument("out", help="output .mbtiles file")
+    build_parser.add_argument("--region", default=None, help="scan this region first")
+    build_parser.add_argument("--min-zoom", type=int, default=6)
+    build_parser.add_argument("--max-zoom", type=int, default=14)
+
+    serve_parser = commands.add_parser("serve", help="serve a tile pyramid")
+    serve_parser.add_argument("path", help=".mbtiles file")
+    serve_parser.add_argument("--port", type=int, default=config.tile_server_port)
+    serve_parser.add_argument(
+        "--host", default=config.tile_server_host, help="0.0.0.0 for every interface"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = start_tile_server(args.path, args.port, args.host)
+        print(
+            "serving %s on http://%s:%d/{z}/{x}/{y}.png" % (args.path, args.host, args.port)
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.region:
+        from utils.region_scan import scan_region
+        from utils.model_registry import get_classifier, get_mapping_model
+
+        with tempfile.TemporaryDirectory() as folder:
+            scan_path = os.path.join(folder, "scan.csv")
+            scan_region(args.region, scan_path, get_classifier(), get_mapping_model())
+            cells = load_scan(scan_path)
+    elif args.scan:
+        cells = load_scan(args.scan)
+    else:
+        parser.error("give a scan file or --region")
+
+    count = build(cells, args.out, args.min_zoom, args.max_zoom)
+    print("wrote %d tiles to %s" % (count, args.out))
+
+
+if __name__ == "__main__":
+    main()
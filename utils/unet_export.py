@@ -0,0 +1,231 @@
+"""
+Inference export of the UNet mapping model.
+
+Every DownBlock/UpBlock runs Conv -> ReLU -> BatchNorm. In eval mode
+the batch norm is a per-channel affine map y = s * x + t, and since
+ReLU(s * u) = s * ReLU(u) for s > 0 the scale s is folded into the
+convolution in front of the ReLU, leaving only the shift t. The shift
+is absorbed into the bias of the final 1x1 convolution where possible,
+and kept as a single add elsewhere: the following 3x3 convolutions
+zero-pad their input, so folding it there would change the borders.
+The folded model is then traced and frozen to TorchScript, or exported
+to ONNX.
+
+Batch, height and width stay dynamic, but tracing resolves autocrop
+once: the export only runs on sizes divisible by 2 ** (n_blocks - 1),
+16 for the default UNet, where the skip connections need no crop.
+final_pred and the tiled mode feed it 256 px pictures.
+
+    python -m utils.unet_export utils/mapping_model.ts.pt
+    python -m utils.unet_export utils/mapping_model.onnx
+"""
+
+import copy
+import time
+import argparse
+import contextlib
+import numpy as np
+import torch
+import torch.nn as nn
+from utils import unet_model
+from utils.unet_model import DownBlock, UpBlock
+from utils.map_utils import _forward
+from utils.inference_engine import load_engine
+
+
+class Shift(nn.Module):
+    """
+    Per-channel constant added to [B, C, H, W] inputs, what is left
+    of a batch norm once its scale is folded.
+    """
+
+    def __init__(self, shift: torch.Tensor):
+        super().__init__()
+        self.register_buffer("shift", shift.detach().reshape(1, -1, 1, 1).clone())
+
+    def forward(self, x):
+        return x + self.shift
+
+
+def _bn_affine(norm: nn.BatchNorm2d):
+    scale = norm.weight / torch.sqrt(norm.running_var + norm.eps)
+    shift = norm.bias - norm.running_mean * scale
+    return scale.detach(), shift.detach()
+
+
+def _fold_into(conv: nn.Module, act: nn.Module, norm: nn.Module):
+    """
+    Folds the scale of norm into conv, through the ReLU act.
+    Returns the module replacing norm, or norm itself when it cannot fold.
+    """
+    if not isinstance(norm, nn.BatchNorm2d) or not isinstance(act, nn.ReLU):
+        return norm
+    scale, shift = _bn_affine(norm)
+    if not bool((scale > 0).all()):
+        return norm
+
+    with torch.no_grad():
+        if isinstance(conv, nn.ConvTranspose2d):  # weight is [in, out, kH, kW]
+            conv.weight.mul_(scale.reshape(1, -1, 1, 1))
+        else:  # weight is [out, in, kH, kW]
+            conv.weight.mul_(scale.reshape(-1, 1, 1, 1))
+        conv.bias.mul_(scale)
+    return Shift(shift)
+
+
+def fold_batchnorm(model: nn.Module):
+    """
+    Returns an eval-mode copy of a UNet with its batch norms folded,
+    numerically equivalent to the original in eval mode.
+    """
+    model = copy.deepcopy(model).eval()
+
+    for block in model.modules():
+        if not getattr(block, "normalization", None):
+            continue
+        if isinstance(block, DownBlock):
+            block.norm1 = _fold_into(block.conv1, block.act1, block.norm1)
+            block.norm2 = _fold_into(block.conv2, block.act2, block.norm2)
+        elif isinstance(block, UpBlock):
+            up = block.up if block.up_mode == "transposed" else block.conv0
+            block.norm0 = _fold_into(up, block.act0, block.norm0)
+            block.norm1 = _fold_into(block.conv1, block.act1, block.norm1)
+            block.norm2 = _fold_into(block.conv2, block.act2, block.norm2)
+
+    # the 1x1 final convolution has no padding, the last shift goes into its bias
+    last = model.up_blocks[-1] if len(model.up_blocks) else model.down_blocks[-1]
+    if isinstance(last.norm2, Shift):
+        with torch.no_grad():
+            weight = model.conv_final.weight.flatten(1)  # [out, in]
+            model.conv_final.bias.add_(weight @ last.norm2.shift.flatten())
+        last.norm2 = nn.Identity()
+
+    return model
+
+
+def _traced_autocrop(encoder_layer: torch.Tensor, decoder_layer: torch.Tensor):
+    # plain Python autocrop: while tracing the shape test is resolved once,
+    # so matching shapes leave no op at all in the exported graph
+    if encoder_layer.shape[2:] != decoder_layer.shape[2:]:
+        ds = encoder_layer.shape[2:]
+        es = decoder_layer.shape[2:]
+        encoder_layer = encoder_layer[
+            :,
+            :,
+            ((ds[0] - es[0]) // 2) : ((ds[0] + es[0]) // 2),
+            ((ds[1] - es[1]) // 2) : ((ds[1] + es[1]) // 2),
+        ]
+    return encoder_layer, decoder_layer
+
+
+@contextlib.contextmanager
+def _plain_autocrop():
+    scripted = unet_model.autocrop
+    unet_model.autocrop = _traced_autocrop
+    try:
+        yield
+    finally:
+        unet_model.autocrop = scripted
+
+
+def export(model: nn.Module, path: str, size: int = 256):
+    """
+    Folds and exports the model to path, ONNX if it ends with .onnx
+    and frozen TorchScript otherwise. Returns the folded eager model.
+    The export accepts sizes divisible by 2 ** (n_blocks - 1) only.
+    """
+    multiple = 2 ** (model.n_blocks - 1)
+    if size % multiple:
+        raise ValueError("size must be a multiple of %d, got %d" % (multiple, size))
+    folded = fold_batchnorm(model)
+    example = torch.rand(1, model.in_channels, size, size)
+
+    with _plain_autocrop():
+        _export(folded, example, path)
+    return folded
+
+
+def _export(folded: nn.Module, example: torch.Tensor, path: str):
+    if path.endswith(".onnx"):
+        torch.onnx.export(
+            folded,
+            example,
+            path,
+            input_names=["image"],
+            output_names=["logits"],
+            dynamic_axes={
+                "image": {0: "batch", 2: "height", 3: "width"},
+                "logits": {0: "batch", 2: "height", 3: "width"},
+            },
+            opset_version=17,
+            dynamo=False,
+        )
+    else:
+        with torch.no_grad():
+            traced = torch.jit.trace(folded, example)
+        torch.jit.save(torch.jit.freeze(traced), path)
+
+
+def load_exported(path: str, threads: int = 0):
+    """
+    Loads an exported mapping model, a drop-in for the eager UNet in final_pred.
+    """
+    return load_engine(path, threads=threads)
+
+
+def compare(model, exported, size: int = 256, batch: int = 4, repeat: int = 5):
+    """
+    Runs the eager and the exported model on the same random batch.
+    Returns the max absolute logit difference, the share of mask pixels
+    that agree and the median latency per image of both models.
+    """
+    x = np.random.rand(batch, model.in_channels, size, size).astype(np.float32)
+
+    def timed(m):
+        timings = []
+        for _ in range(repeat + 1):  # the first run warms up
+            start = time.perf_counter()
+            out = _forward(x, m)
+            timings.append(time.perf_counter() - start)
+        return out, float(np.median(timings[1:])) / batch
+
+    reference, eager_time = timed(model)
+    out, exported_time = timed(exported)
+    return {
+        "max_abs_diff": float(np.abs(reference - out).max()),
+        "mask_agreement": float(
+            np.mean(reference.argmax(axis=1) == out.argmax(axis=1))
+        ),
+        "eager_ms": eager_time * 1000,
+        "exported_ms": exported_time * 1000,
+    }
+
+
+def main():
+    from utils.model_registry import _load_eager_mapping_model
+
+    parser = argparse.ArgumentParser(description="export the mapping model")
+    parser.add_argument("out", help="output .pt (TorchScript) or .onnx file")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    model = _load_eager_mapping_model()
+    export(model, args.out, args.size)
+
+    report = compare(model, load_exported(args.out), args.size)
+    print(
+        "max |diff| %.2e, mask agreement %.4f, %.1f ms -> %.1f ms per image"
+        % (
+            report["max_abs_diff"],
+            report["mask_agreement"],
+            report["eager_ms"],
+            report["exported_ms"],
+        )
+    )
+    if report["max_abs_diff"] > args.atol:
+        raise SystemExit("exported model differs from the eager one")
+
+
+if __name__ == "__main__":
+    main()
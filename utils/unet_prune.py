@@ -0,0 +1,261 @@
+"""
+Structured channel pruning of the UNet mapping model.
+
+Every convolution of the DownBlocks/UpBlocks keeps its most important
+filters and drops the others, together with the matching BatchNorm
+channels and the input channels of the layers they feed. Importance is
+the BatchNorm scale |gamma| / sqrt(running_var + eps) of the channel
+("bn"), or the L1 norm of the filter ("magnitude", also used when the
+model has no BatchNorm). A down block output feeds both the next down
+block and a skip connection, so both keep the same channels.
+
+The UNet constructor only knows start_filters, so every layer is
+pruned by the same ratio and the slim model is a plain
+UNet(start_filters=...) loading through the usual config:
+halving start_filters divides the convolution work by about four.
+Every DownBlock/UpBlock runs Conv -> ReLU -> BatchNorm, so a dropped
+channel is replaced by its mean, the BatchNorm beta, folded into the
+bias of the layers it fed.
+
+    python -m utils.unet_prune samples/ utils/mapping_weights.16.pt --start-filters 16
+    python -m utils.unet_prune samples/ --sweep 24,16,12,8
+"""
+
+import json
+import argparse
+import torch
+import torch.nn as nn
+import config
+from utils.unet_model import UNet
+
+
+class _Channels:
+    """
+    Kept and dropped output channels of a layer, with the mean output
+    of the dropped ones when known (the BatchNorm beta).
+    """
+
+    def __init__(self, size: int, keep: torch.Tensor, norm: nn.Module = None):
+        self.size = size
+        self.keep = keep
+        dropped = torch.ones(size, dtype=torch.bool)
+        dropped[keep] = False
+        self.dropped = torch.nonzero(dropped)[:, 0]
+        self.means = None
+        if isinstance(norm, nn.modules.batchnorm._BatchNorm) and len(self.dropped):
+            self.means = norm.bias.detach()[self.dropped]
+
+
+def _is_transposed(conv):
+    return isinstance(conv, (nn.ConvTranspose2d, nn.ConvTranspose3d))
+
+
+def importance(conv: nn.Module, norm: nn.Module = None, method: str = "bn"):
+    """
+    Importance of each output channel of conv, followed by norm.
+    """
+    if method == "bn" and isinstance(norm, nn.modules.batchnorm._BatchNorm):
+        return (norm.weight.abs() / torch.sqrt(norm.running_var + norm.eps)).detach()
+    weight = conv.weight.detach().abs()
+    out_dim = 1 if _is_transposed(conv) else 0
+    return weight.transpose(0, out_dim).flatten(1).sum(1)
+
+
+def _select(scores: torch.Tensor, count: int, norm: nn.Module = None):
+    keep = torch.sort(torch.argsort(scores, descending=True)[:count]).values
+    return _Channels(len(scores), keep, norm)
+
+
+def _copy_conv(dst, src, out: _Channels, inputs):
+    """
+    Copies the kept filters of src into dst. inputs lists the channel
+    groups concatenated at the input of src, in order.
+    """
+    weight = src.weight.detach()
+    bias = src.bias.detach().clone()
+    in_dim = 0 if _is_transposed(src) else 1
+    spatial = tuple(range(2, weight.dim()))
+
+    keep, offset = [], 0
+    for group in inputs:
+        keep.append(group.keep + offset)
+        if group.means is not None:
+            dropped = weight.index_select(in_dim, group.dropped + offset)
+            if _is_transposed(src):
+                # every output pixel sees one tap of the kernel, use their mean
+                bias += (dropped.mean(spatial) * group.means[:, None]).sum(0)
+            else:
+                bias += (dropped.sum(spatial) * group.means).sum(1)
+        offset += group.size
+
+    weight = weight.index_select(in_dim, torch.cat(keep))
+    weight = weight.index_select(1 - in_dim, out.keep)
+    with torch.no_grad():
+        dst.weight.copy_(weight)
+        dst.bias.copy_(bias[out.keep])
+
+
+def _copy_norm(dst, src, out: _Channels):
+    if src is None:
+        return
+    state = {
+        key: value[out.keep] if value.dim() else value
+        for key, value in src.state_dict().items()
+    }
+    dst.load_state_dict(state)
+
+
+def unet_config(model: UNet):
+    """
+    Constructor arguments of a UNet.
+    """
+    keys = [
+        "in_channels",
+        "out_channels",
+        "n_blocks",
+        "start_filters",
+        "activation",
+        "normalization",
+        "conv_mode",
+        "dim",
+        "up_mode",
+    ]
+    return {key: getattr(model, key) for key in keys}
+
+
+def prune(model: UNet, start_filters: int, method: str = "bn"):
+    """
+    Returns a UNet with start_filters filters in its first block, made
+    of the most important filters of model (see importance).
+    """
+    model = model.eval()
+    slim = UNet(**dict(unet_config(model), start_filters=start_filters)).eval()
+    norm = lambda block, name: getattr(block, name, None)
+
+    inputs = [_Channels(model.in_channels, torch.arange(model.in_channels))]
+    skips = []
+    for old, new in zip(model.down_blocks, slim.down_blocks):
+        mid = _select(
+            importance(old.conv1, norm(old, "norm1"), method),
+            new.out_channels,
+            norm(old, "norm1"),
+        )
+        out = _select(
+            importance(old.conv2, norm(old, "norm2"), method),
+            new.out_channels,
+            norm(old, "norm2"),
+        )
+        _copy_conv(new.conv1, old.conv1, mid, inputs)
+        _copy_norm(norm(new, "norm1"), norm(old, "norm1"), mid)
+        _copy_conv(new.conv2, old.conv2, out, [mid])
+        _copy_norm(norm(new, "norm2"), norm(old, "norm2"), out)
+        inputs = [out]
+        skips.append(out)
+
+    for i, (old, new) in enumerate(zip(model.up_blocks, slim.up_blocks)):
+        skip = skips[-(i + 2)]
+        # the up-convolution, or conv0 after upsampling, feeds act0/norm0
+        producer = old.up if old.up_mode == "transposed" else old.conv0
+        up = _select(
+            importance(producer, norm(old, "norm0"), method),
+            new.out_channels,
+            norm(old, "norm0"),
+        )
+        if old.up_mode == "transposed":
+            _copy_conv(new.up, old.up, up, inputs)
+        _copy_conv(new.conv0, old.conv0, up, inputs)
+        _copy_norm(norm(new, "norm0"), norm(old, "norm0"), up)
+
+        mid = _select(
+            importance(old.conv1, norm(old, "norm1"), method),
+            new.out_channels,
+            norm(old, "norm1"),
+        )
+        out = _select(
+            importance(old.conv2, norm(old, "norm2"), method),
+            new.out_channels,
+            norm(old, "norm2"),
+        )
+        _copy_conv(new.conv1, old.conv1, mid, [up, skip])
+        _copy_norm(norm(new, "norm1"), norm(old, "norm1"), mid)
+        _copy_conv(new.conv2, old.conv2, out, [mid])
+        _copy_norm(norm(new, "norm2"), norm(old, "norm2"), out)
+        inputs = [out]
+
+    classes = _Channels(model.out_channels, torch.arange(model.out_channels))
+    _copy_conv(slim.conv_final, model.conv_final, classes, inputs)
+    return slim
+
+
+def save(model: UNet, path: str):
+    """
+    Saves the weights to path and the constructor arguments next to
+    them, in path with a .json extension.
+    """
+    torch.save(model.state_dict(), path)
+    config_path = path.rsplit(".", 1)[0] + ".json"
+    with open(config_path, "w") as f:
+        json.dump(unet_config(model), f, indent=2)
+    return config_path
+
+
+def sweep(model: UNet, tiles, widths, method: str = "bn"):
+    """
+    compare_models report of model pruned to each start_filters in widths.
+    """
+    from utils.model_eval import compare_models
+
+    reports = {}
+    for width in widths:
+        report = compare_models(model, prune(model, width, method), tiles)
+        reports[width] = dict(report, start_filters=width)
+    return reports
+
+
+def main():
+    from utils.model_eval import load_tiles, compare_models, print_report
+    from utils.model_registry import _load_eager_mapping_model
+
+    parser = argparse.ArgumentParser(description="prune the mapping model")
+    parser.add_argument("tiles", help="folder of sample tiles to evaluate on")
+    parser.add_argument("out", nargs="?", help="output weights .pt file")
+    parser.add_argument(
+        "--start-filters",
+        type=int,
+        default=config.mapping_model["start_filters"] // 2,
+        help="filters of the first block of the slim model",
+    )
+    parser.add_argument("--method", default="bn", choices=["bn", "magnitude"])
+    parser.add_argument("--sweep", default=None, help="comma separated start_filters")
+    parser.add_argument("--limit", type=int, default=None, help="tiles to evaluate on")
+    args = parser.parse_args()
+
+    model = _load_eager_mapping_model()
+    tiles = load_tiles(args.tiles, size=config.model_size, limit=args.limit)
+
+    if args.sweep:
+        widths = [int(width) for width in args.sweep.split(",")]
+        for width, report in sweep(model, tiles, widths, args.method).items():
+            print(
+                "start_filters %3d  speedup %5.2fx  mean IoU %.4f  min IoU %.4f  %6.2f MB"
+                % (
+                    width,
+                    report["speedup"],
+                    report["mean_iou"],
+                    report["min_iou"],
+                    report["candidate_mb"],
+                )
+            )
+        return
+    if not args.out:
+        parser.error("give an output file, or --sweep")
+
+    slim = prune(model, args.start_filters, args.method)
+    config_path = save(slim, args.out)
+    print_report(compare_models(model, slim, tiles))
+    print('mapping_weights = "%s"' % args.out)
+    print("mapping_model = %s  # from %s" % (unet_config(slim), config_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+INT8 static post-training quantization of the UNet mapping model.
+
+Conv + ReLU pairs of every DownBlock/UpBlock are fused, the
+Concatenate of the skip connections is swapped for a quantized cat,
+activation ranges are calibrated on a folder of sample tiles and the
+model is converted to int8 (fbgemm/x86 kernels). The transposed
+up-convolutions are quantized with per-tensor weights, the only scheme
+their int8 kernel supports. The result is saved as TorchScript, so
+config.mapping_export can point final_pred to it.
+
+    python -m utils.unet_quant samples/ utils/mapping_model.int8.pt
+"""
+
+import copy
+import argparse
+import torch
+import torch.nn as nn
+import torch.ao.quantization as tq
+from utils.map_utils import _preprocess_batch
+from utils.unet_model import DownBlock, UpBlock, Concatenate
+from utils.unet_export import _plain_autocrop
+
+
+class QuantConcatenate(Concatenate):
+    def __init__(self):
+        super().__init__()
+        self.cat = torch.ao.nn.quantized.FloatFunctional()
+
+    def forward(self, layer_1, layer_2):
+        return self.cat.cat((layer_1, layer_2), 1)
+
+
+class QuantizableUNet(nn.Module):
+    """
+    UNet between a quantize and a dequantize stub: float in, float out.
+    """
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.quant = tq.QuantStub()
+        self.model = model
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.model(self.quant(x)))
+
+
+def prepare(model: nn.Module, backend: str = "x86"):
+    """
+    Returns a copy of the float model ready for calibration.
+    """
+    model = copy.deepcopy(model).eval()
+
+    for block in model.modules():
+        if isinstance(block, (DownBlock, UpBlock)):
+            pairs = [["conv1", "act1"], ["conv2", "act2"]]
+            pairs = [p for p in pairs if isinstance(getattr(block, p[1]), nn.ReLU)]
+            tq.fuse_modules(block, pairs, inplace=True)
+        if isinstance(block, UpBlock):
+            block.concat = QuantConcatenate()
+
+    torch.backends.quantized.engine = backend
+    wrapped = QuantizableUNet(model)
+    wrapped.qconfig = tq.get_default_qconfig(backend)
+    for block in model.modules():
+        if isinstance(block, UpBlock) and block.up_mode == "transposed":
+            block.up.qconfig = tq.QConfig(
+                activation=wrapped.qconfig.activation,
+                weight=tq.default_weight_observer,
+            )
+    return tq.prepare(wrapped)
+
+
+def calibrate(prepared: nn.Module, tiles, batch_size: int = 8):
+    """
+    Feeds [H, W, C] tiles through the observers of a prepared model.
+    """
+    with torch.no_grad():
+        for i in range(0, len(tiles), batch_size):
+            prepared(torch.from_numpy(_preprocess_batch(tiles[i : i + batch_size])))
+    return prepared
+
+
+def quantize(model: nn.Module, tiles, backend: str = "x86"):
+    """
+    Returns the int8 version of model, calibrated on tiles.
+    """
+    prepared = calibrate(prepare(model, backend), tiles)
+    return tq.convert(prepared.eval())
+
+
+def save(quantized: nn.Module, path: str, size: int = 256):
+    example = torch.rand(1, quantized.model.in_channels, size, size)
+    with _plain_autocrop(), torch.no_grad():
+        traced = torch.jit.trace(quantized, example)
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+
+def main():
+    from utils.model_eval import load_tiles, compare_models, print_report
+    from utils.model_registry import _load_eager_mapping_model
+
+    parser = argparse.ArgumentParser(description="quantize the mapping model")
+    parser.add_argument("tiles", help="folder of sample tiles for calibration")
+    parser.add_argument("out", help="output TorchScript .pt file")
+    parser.add_argument("--limit", type=int, default=64, help="tiles to calibrate on")
+    parser.add_argument("--eval", default=None, help="folder of tiles to evaluate on")
+    parser.add_argument("--backend", default="x86", choices=["x86", "fbgemm", "qnnpack"])
+    args = parser.parse_args()
+
+    model = _load_eager_mapping_model()
+    quantized = quantize(model, load_tiles(args.tiles, limit=args.limit), args.backend)
+    save(quantized, args.out)
+
+    from utils.unet_export import load_exported
+
+    eval_tiles = load_tiles(args.eval or args.tiles)
+    print_report(compare_models(model, load_exported(args.out), eval_tiles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Pooled WMS client.
+
+Requests check a persistent HTTP/1.1 connection to the WMS host out of
+a pool of at most max_connections and return it afterwards, so
+consecutive GetMap requests skip the TCP/TLS handshake whichever thread
+makes them.
+Pictures are returned as JPEG bytes, nothing is written to disk.
+
+Benchmark against the local stand-in server:
+
+    python -m utils.wms_fetch --requests 64 --connections 8
+"""
+
+import time
+import random
+import argparse
+import threading
+import http.client
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.instrumentation import count
+
+LAYER_PARAMS = {
+    "LAYERS": "HR.ORTHOIMAGERY.ORTHOPHOTOS",
+    "EXCEPTIONS": "text/xml",
+    "FORMAT": "image/jpeg",
+    "SERVICE": "WMS",
+    "VERSION": "1.3.0",
+    "REQUEST": "GetMap",
+    "STYLES": "",
+    "CRS": "EPSG:4326",
+}
+
+# statuses worth retrying, everything else fails straight away
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class WMSError(Exception):
+    pass
+
+
+def getmap_query(bbox: str, width: int = 4000, height: int = 4000, **params):
+    query = {**LAYER_PARAMS, **params, "WIDTH": width, "HEIGHT": height}
+    # the bbox is appended as is, commas included, like the IGN viewer does
+    return urllib.parse.urlencode(query, safe=":/") + "&BBOX=" + bbox
+
+
+class WMSFetcher:
+    """
+    Thread-safe GetMap client with a pool of persistent connections.
+
+    max_connections bounds both the thread pool used by fetch_many and
+    the number of simultaneous requests; failed requests are retried
+    up to retries times with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_connections: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 60,
+    ):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or "/"
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._idle = []  # connections ready for the next request
+        self._connections = []  # every open connection, idle or not
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._pool = None
+
+    def _checkout(self):
+        # callers hold a slot, so at most max_connections are ever open
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def _discard(self, conn):
+        conn.close()
+        with self._lock:
+            self._connections.remove(conn)
+
+    def _get(self, target: str):
+        conn = self._checkout()
+        try:
+            conn.request("GET", target, headers={"Connection": "keep-alive"})
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # stale or broken keep-alive connection, reconnect on retry
+            self._discard(conn)
+            raise
+        if response.will_close:
+            self._discard(conn)
+        else:
+            self._checkin(conn)
+        return response.status, response.getheader("Content-Type", ""), body
+
+    def fetch(self, bbox: str, width: int = 4000, height: int = 4000, **params):
+        """
+        Downloads one picture and returns the raw image bytes.
+        """
+        target = self.path + "?" + getmap_query(bbox, width, height, **params)
+
+        for attempt in range(self.retries + 1):
+            try:
+                with self._slots:
+                    status, content_type, body = self._get(target)
+            except (http.client.HTTPException, OSError) as e:
+                error = WMSError("%s for bbox %s" % (e, bbox))
+            else:
+                if status == 200 and content_type.startswith("image/"):
+                    count("wms_bytes", len(body))
+                    return body
+                # WMS exceptions come back as XML, sometimes with a 200 status
+                error = WMSError(
+                    "HTTP %d (%s) for bbox %s: %s"
+                    % (status, content_type, bbox, body[:200])
+                )
+                if status != 200 and status not in RETRY_STATUS:
+                    raise error
+
+            if attempt < self.retries:
+                count("wms_retries")
+                delay = self.backoff * 2**attempt
+                time.sleep(delay + random.uniform(0, delay / 2))
+        raise error
+
+    def fetch_many(self, bboxes, width: int = 4000, height: int = 4000, **params):
+        """
+        Downloads pictures concurrently, yields (bbox, bytes) in input order.
+        At most 2 * max_connections downloads are in flight at a time.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_connections)
+
+        pending = deque()
+        for bbox in bboxes:
+            pending.append(
+                (bbox, self._pool.submit(self.fetch, bbox, width, height, **params))
+            )
+            if len(pending) >= 2 * self.max_connections:
+                bbox, future = pending.popleft()
+                yield bbox, future.result()
+        while pending:
+            bbox, future = pending.popleft()
+            yield bbox, future.result()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            self._idle.clear()
+
+
+def main():
+    import urllib.request
+    from utils.wms_stub import start_stub_server
+
+    parser = argparse.ArgumentParser(description="benchmark the fetcher offline")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(latency=args.latency)
+    bboxes = [
+        "48.8492,%.6f,48.8508,%.6f" % (2.3492 + i * 0.0016, 2.3508 + i * 0.0016)
+        for i in range(args.requests)
+    ]
+
+    start = time.perf_counter()
+    for bbox in bboxes:
+        with urllib.request.urlopen(
+            url + "?" + getmap_query(bbox, args.size, args.size)
+        ) as response:
+            response.read()
+    baseline = time.perf_counter() - start
+
+    fetcher = WMSFetcher(url, max_connections=args.connections)
+    start = time.perf_counter()
+    total = sum(len(data) for _, data in fetcher.fetch_many(bboxes, args.size, args.size))
+    pooled = time.perf_counter() - start
+    fetcher.close()
+    server.shutdown()
+
+    print("urllib, sequential   : %.1f pictures/s" % (args.requests / baseline))
+    print(
+        "pooled, %2d connections: %.1f pictures/s (%.1f MB)"
+        % (args.connections, args.requests / pooled, total / 1e6)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local stand-in for the IGN WMS endpoint.
+
+Answers GetMap requests with a synthetic JPEG of the requested size,
+drawn deterministically from the bbox, over keep-alive HTTP/1.1.
+Used to test and benchmark the fetcher without network access:
+
+    python -m utils.wms_stub --port 8080
+    # then set wms_url = "http://localhost:8080/wms" in config.py
+"""
+
+import io
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+
+def render_picture(bbox: str, width: int, height: int):
+    """
+    Fake orthophoto: a field colour with a few round silos, as JPEG bytes.
+    """
+    rng = random.Random(hashlib.md5(bbox.encode()).digest())
+    image = Image.new("RGB", (width, height), (rng.randint(60, 120), 110, 60))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(0, 4)):
+        radius = rng.uniform(0.02, 0.08) * width
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=(200, 200, 195))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        self.server.requests.append(self.path)
+        time.sleep(self.latency)
+
+        if url.path != "/wms":
+            self._send(404, "text/plain", b"not found")
+            return
+        if random.random() < self.fail_rate:
+            self._send(503, "text/plain", b"try again")
+            return
+        try:
+            bbox = query["BBOX"][0]
+            width, height = int(query["WIDTH"][0]), int(query["HEIGHT"][0])
+        except (KeyError, ValueError):
+            body = b"<ServiceExceptionReport>bad GetMap request</ServiceExceptionReport>"
+            self._send(200, "text/xml", body)
+            return
+        self._send(200, "image/jpeg", render_picture(bbox, width, height))
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _make_server(port: int, latency: float, fail_rate: float):
+    handler = type(
+        "Handler", (StubHandler,), {"latency": latency, "fail_rate": fail_rate}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.requests = []  # paths of the requests received, in order
+    return server
+
+
+def start_stub_server(port: int = 0, latency: float = 0.0, fail_rate: float = 0.0):
+    """
+    Serves the stub from a background thread, port=0 picks a free port.
+    Returns the server and the WMS url to fetch from. server.requests
+    lists the paths requested so far.
+    """
+    server = _make_server(port, latency, fail_rate)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/wms" % server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of 503s")
+    args = parser.parse_args()
+
+    server = _make_server(args.port, args.latency, args.fail_rate)
+    print("stub WMS on http://127.0.0.1:%d/wms" % args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()